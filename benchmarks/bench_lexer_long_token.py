@@ -0,0 +1,42 @@
+"""
+
+Benchmark lexing a template consisting of one very long TXT token.
+
+Lexing time should grow linearly with the size of the token; the
+per-MB time printed for each size should therefore stay roughly flat.
+
+Usage: python benchmarks/bench_lexer_long_token.py [size_mb]
+"""
+import sys
+import time
+from io import StringIO
+from ghostwriter.lang.lexer import Lexer
+from ghostwriter.moustache.lexer import MoustacheLexer
+
+LINE = "some text which is not a tag, but which { has the odd brace }\n"
+
+
+def template(size_mb: int) -> str:
+    lines = (size_mb * 1024 * 1024) // len(LINE)
+    return LINE * lines + "{{name}}"
+
+
+def bench(size_mb: int) -> float:
+    src = template(size_mb)
+    start = time.perf_counter()
+    toks = list(MoustacheLexer(Lexer(StringIO(src))).start())
+    elapsed = time.perf_counter() - start
+    assert [tok.type for tok in toks] == ["TXT", "EXPR"]
+    assert len(toks[0].literal) == len(src) - len("{{name}}")
+    return elapsed
+
+
+def main(size_mb: int = 50) -> None:
+    sizes = [size_mb // 8, size_mb // 4, size_mb // 2, size_mb]
+    for size in (s for s in sizes if s > 0):
+        elapsed = bench(size)
+        print(f"{size:>5} MB TXT token: {elapsed:8.3f}s ({elapsed / size * 1000:7.2f} ms/MB)")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
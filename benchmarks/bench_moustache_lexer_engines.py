@@ -0,0 +1,51 @@
+"""
+
+Benchmark the MoustacheLexer against the regex-driven RegexMoustacheLexer.
+
+Both lex the same template, a mix of text, expressions, sections and
+partials, and must produce the same tokens.
+
+Usage: python benchmarks/bench_moustache_lexer_engines.py [size_kb]
+"""
+import sys
+import time
+from io import StringIO
+from ghostwriter.lang.lexer import Lexer
+from ghostwriter.moustache.lexer import MoustacheLexer
+from ghostwriter.moustache.scanner import RegexMoustacheLexer
+
+CHUNK = (
+    "<h1>{{ title }}</h1>\n"
+    "{{! the list of users }}\n"
+    "{{#users}}\n"
+    "  <li>{{ name | upper }} ({{age}}) {{> badge }}</li>\n"
+    "{{/users}}\n"
+)
+
+
+def template(size_kb: int) -> str:
+    return CHUNK * ((size_kb * 1024) // len(CHUNK))
+
+
+def bench(name: str, lex, src: str, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        toks = list(lex(src))
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:>20}: {best * 1000:8.2f} ms ({len(toks)} tokens)")
+    return best
+
+
+def main(size_kb: int = 1024) -> None:
+    src = template(size_kb)
+    expected = list(MoustacheLexer(Lexer(StringIO(src))).start())
+    assert list(RegexMoustacheLexer(src).start()) == expected
+    print(f"{len(src) // 1024} KB template")
+    reference = bench("MoustacheLexer", lambda s: MoustacheLexer(Lexer(StringIO(s))).start(), src)
+    regex = bench("RegexMoustacheLexer", lambda s: RegexMoustacheLexer(s).start(), src)
+    print(f"{'speedup':>20}: {reference / regex:8.2f}x")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,122 @@
+"""
+
+Drive the (synchronous) lexers from asyncio byte sources.
+
+The Lexer pulls its input, so it cannot wait for input to arrive without
+blocking. Instead it reads from a `Feed` holding whatever has arrived so
+far. If the lexer reads past that, the feed hands it an EOF but marks itself
+as starved; the tokens lexed (or errors raised) since are then discarded,
+the lexer restored to where it was after the last good token and re-run
+once more input has arrived. Each retry waits for at least as much new
+input as is re-lexed, keeping the total cost linear.
+
+Tokenizers driven like this must offer:
+* `lexer`: the Lexer reading from the feed
+* `start()`: a token generator, which can be restarted after any yield
+* `checkpoint()`/`restore(cp)`: save/restore its (and its lexer's) state
+"""
+import io
+import typing as t
+from collections import deque
+from .token import Token
+from .lexer import READ_SIZE
+
+AsyncByteSource = t.Any  # object with `async read(n)` or an async iterable of bytes
+
+
+def _source_reader(source: AsyncByteSource) -> t.Callable[[int], t.Awaitable[bytes]]:
+    if hasattr(source, 'read'):  # asyncio.StreamReader and the like
+        return source.read
+    chunks = source.__aiter__()
+
+    async def read(n: int) -> bytes:
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+    return read
+
+
+class Feed(io.RawIOBase):
+    """
+    Binary stream of the input received from an async source so far.
+    """
+
+    def __init__(self, source: AsyncByteSource):
+        super().__init__()
+        self._source_read = _source_reader(source)
+        self.chunks = deque()
+        self.buffered = 0
+        # True if read() ran out of input which has yet to arrive
+        self.starved = False
+        self.at_eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, n: int = -1) -> bytes:
+        if not self.chunks:
+            if not self.at_eof:
+                self.starved = True
+            return b""
+        chunk = self.chunks.popleft()
+        if 0 <= n < len(chunk):
+            self.chunks.appendleft(chunk[n:])
+            chunk = chunk[:n]
+        self.buffered -= len(chunk)
+        return chunk
+
+    async def fill(self, n: int) -> None:
+        """
+        Receive at least `n` bytes (or whatever is left before EOF), and at least one chunk.
+        """
+        self.starved = False
+        received = False
+        while not self.at_eof and (not received or self.buffered < n):
+            chunk = await self._source_read(max(n - self.buffered, READ_SIZE))
+            if not chunk:
+                self.at_eof = True
+                break
+            self.chunks.append(bytes(chunk))
+            self.buffered += len(chunk)
+            received = True
+
+
+async def tokens_async(tokenizer, feed: Feed) -> t.AsyncIterator[Token]:
+    """
+    Yield the tokens of `tokenizer`, whose lexer reads from `feed`.
+    """
+    lexer = tokenizer.lexer
+    checkpoint = tokenizer.checkpoint()
+    checkpoint_pos = lexer.pos
+    tokens = tokenizer.start()
+    try:
+        while True:
+            tok = None
+            try:
+                tok = next(tokens)
+            except StopIteration:
+                if not feed.starved:
+                    return
+            except Exception:
+                # e.g. a LexerError, or a UnicodeDecodeError on a character
+                # split across chunks, which may not hold with more input
+                if not feed.starved:
+                    raise
+
+            if not feed.starved:
+                checkpoint = tokenizer.checkpoint()
+                checkpoint_pos = lexer.pos
+                yield tok
+                continue
+
+            # lexed as if the input ended where what has arrived so far does,
+            # wait for more and start over from the last good token.
+            relex = lexer.pos - checkpoint_pos
+            tokens.close()
+            tokenizer.restore(checkpoint)
+            await feed.fill(max(relex, lexer.read_size))
+            tokens = tokenizer.start()
+    finally:
+        tokens.close()
+        lexer.release()
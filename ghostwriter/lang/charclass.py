@@ -0,0 +1,80 @@
+"""
+
+Precompiled character classes for the Lexer's *_while / *_until scans.
+
+A `CharClass` compiles its alphabet into two regular expressions, one
+matching a run of characters inside the class and one matching a run of
+characters outside it. The Lexer uses these to scan its buffer at C speed
+rather than testing every character in Python.
+"""
+import re
+import attr
+import typing as t
+from functools import lru_cache
+
+
+def _char_set(chars: t.FrozenSet[str]) -> str:
+    # sorted for a deterministic pattern, escaped for use inside [...]
+    return "".join(re.escape(c) for c in sorted(chars))
+
+
+@attr.s(slots=True, cmp=False)
+class CharClass:
+    chars = attr.ib(type=t.FrozenSet[str], converter=frozenset)
+
+    # compiled `[...]*` / `[^...]*` patterns, use `.match(buf, pos).end()`
+    # to find where a run of (non-)members starting at `pos` ends.
+    span_while = attr.ib(init=False, repr=False)
+    span_until = attr.ib(init=False, repr=False)
+
+    # the same, for scanning bytes. None unless all characters are ASCII
+    bspan_while = attr.ib(init=False, repr=False, default=None)
+    bspan_until = attr.ib(init=False, repr=False, default=None)
+
+    def __attrs_post_init__(self):
+        if self.chars:
+            char_set = _char_set(self.chars)
+            pat_while, pat_until = f"[{char_set}]*", f"[^{char_set}]*"
+        else:
+            # nothing is a member of the empty class
+            pat_while, pat_until = "", "(?s:.*)"
+        self.span_while = re.compile(pat_while).match
+        self.span_until = re.compile(pat_until).match
+        if all(c.isascii() for c in self.chars):
+            self.bspan_while = re.compile(pat_while.encode("ascii")).match
+            self.bspan_until = re.compile(pat_until.encode("ascii")).match
+
+    def __contains__(self, c: str) -> bool:
+        return c in self.chars
+
+    def __or__(self, other: t.Union["CharClass", str]) -> "CharClass":
+        return charclass(self.chars | charclass(other).chars)
+
+    def __eq__(self, other):
+        if not isinstance(other, CharClass):
+            return NotImplemented
+        return self.chars == other.chars
+
+    def __hash__(self):
+        return hash(self.chars)
+
+
+Alphabet = t.Union[CharClass, str]
+
+
+@lru_cache(maxsize=256)
+def _charclass_from_str(alphabet: str) -> CharClass:
+    return CharClass(alphabet)
+
+
+def charclass(alphabet: Alphabet) -> CharClass:
+    """
+    Return `alphabet` as a CharClass.
+
+    Plain strings are compiled once and cached, so passing the same string
+    repeatedly is cheap - though building the CharClass at module level
+    and passing that around is cheaper still.
+    """
+    if isinstance(alphabet, CharClass):
+        return alphabet
+    return _charclass_from_str(alphabet)
@@ -0,0 +1,98 @@
+"""
+
+Persistent cache of compiled code, shared between processes.
+
+Entries are marshalled (typically code objects) into one file per key.
+Files are written to a temporary file and atomically moved into place, so
+concurrent processes may read and write the same cache directory: a reader
+sees either a complete entry or none at all.
+
+Keys include the ghostwriter version and the interpreter's bytecode magic
+number, so entries written by other versions are simply never looked up.
+"""
+import attr
+import hashlib
+import marshal
+import os
+import tempfile
+import typing as t
+from importlib.util import MAGIC_NUMBER
+from ghostwriter import __version__
+
+SUFFIX = ".gwc"
+
+
+@attr.s(slots=True, frozen=True)
+class DiskCodeCache:
+    directory = attr.ib(type=str, converter=os.fspath)
+
+    def key(self, *parts: str) -> str:
+        """
+        Return the key for an entry derived from `parts` (e.g. source text and options).
+        """
+        h = hashlib.sha256()
+        for part in (__version__, MAGIC_NUMBER.hex(), *parts):
+            data = part.encode("utf-8", "surrogatepass")
+            # length-prefixed so that ("ab", "c") and ("a", "bc") differ
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, key: str) -> t.Any:
+        """
+        Return the value stored under `key`, None if there is none (or it is unreadable).
+        """
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if data[:len(MAGIC_NUMBER)] != MAGIC_NUMBER:
+            return None
+        try:
+            return marshal.loads(memoryview(data)[len(MAGIC_NUMBER):])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, key: str, value: t.Any) -> bool:
+        """
+        Store the marshallable `value` under `key`, replacing any previous entry.
+
+        Returns False if the entry could not be written, the cache is only
+        an optimization so this is not an error.
+        """
+        data = MAGIC_NUMBER + marshal.dumps(value)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path(key))
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def clear(self) -> None:
+        """
+        Remove all entries.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith(SUFFIX):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
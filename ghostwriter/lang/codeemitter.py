@@ -1,25 +1,225 @@
+from array import array
+from collections import OrderedDict
+from itertools import repeat
+from . import sourcemap
+
+
+class _Indents(dict):
+    """The indentation strings by level, each built once and shared by all lines."""
+
+    def __missing__(self, level):
+        indent = self[level] = " " * level
+        return indent
+
+
+INDENTS = _Indents()
+
+# number of code objects compile_source() keeps in memory
+CODE_CACHE_SIZE = 128
+# (sha256 of the source, filename): code object, least recently used first
+_code_cache = OrderedDict()
+
+
+def compile_source(source, filename=None, cache=None):
+    """Compile `source` (for exec), reusing the code object if it was compiled before.
+
+    Code objects are kept in an in-process LRU cache, keyed by a hash of
+    the source. If a DiskCodeCache is given, they are looked up on (and
+    stored to) disk as well, so that other processes can skip compiling.
+
+    `filename` defaults to the source's pseudo-filename, see
+    `sourcemap.source_filename`."""
+    digest = sourcemap.source_digest(source)
+    if filename is None:
+        filename = sourcemap.source_filename(source, digest)
+    key = (digest, filename)
+    code = _code_cache.get(key)
+    if code is not None:
+        _code_cache.move_to_end(key)
+        return code
+
+    disk_key = cache.key("codeemitter", filename, source) if cache is not None else None
+    if cache is not None:
+        code = cache.load(disk_key)
+    if code is None:
+        code = compile(source, filename, "exec")
+        if cache is not None:
+            cache.store(disk_key, code)
+
+    _code_cache[key] = code
+    if len(_code_cache) > CODE_CACHE_SIZE:
+        _code_cache.popitem(last=False)
+    return code
+
+
+def clear_code_cache():
+    """Forget the code objects compiled by compile_source() so far."""
+    _code_cache.clear()
+
+
 class CodeEmitter(object):
-    """Conveniently generate and evaluate source code."""
+    """Conveniently generate and evaluate source code.
+
+    Each line is stored as is, along with its indentation level (in an
+    array, parallel to `code`). The indentation and newline are only
+    added when rendering, using shared indentation strings."""
     INDENT_STEP = 3
+    # approximate number of characters write_to() buffers per write
+    WRITE_SIZE = 65536
 
-    def __init__(self, indent=0):
+    def __init__(self, indent=0, parent=None):
+        # the lines and sections (CodeEmitter instances) added
         self.code = []
+        # the indentation level of each entry in `code`
+        self.levels = array("i")
         self.indent_level = indent
+        # the CodeEmitter this is a section of, if any
+        self.parent = parent
+        # the rendered code, kept only by the section last rendered as a whole
+        self._text = None
+        # its own lines rendered, runs of text between its sections (kept as
+        # is), None if it changed since
+        self._parts = None
+        # False if this or any of its sections changed since it was rendered
+        self._clean = False
+        # the origin of each entry in `code`, once any line was added with one
+        self.origins = None
+        # True if this or any of its sections has origins
+        self.mapped = False
 
     def __str__(self):
         """render out the entire code.
 
         Note: because CodeEmitter may contain other CodeEmitter instances
-              (as extensible sections), this call may recursively
-              render many objects."""
-        return "".join(str(line) for line in self.code)
+              (as extensible sections), this renders all of them. Each of
+              them caches its own lines rendered, so rendering again only
+              re-renders the lines of the sections changed since."""
+        if self._text is None:
+            self._render()
+        return self._text
+
+    def _render(self):
+        """Render the code, reusing the rendered lines of the sections unchanged since.
+
+        Only the section rendered keeps its whole text, not each of its
+        sections, so the memory used does not grow with the nesting depth."""
+        chunks = []
+        stack = [iter((self,))]
+        while stack:
+            for chunk in stack[-1]:
+                if isinstance(chunk, CodeEmitter):
+                    if chunk._text is not None:
+                        # rendered as a whole before, now part of this text
+                        chunks.append(chunk._text)
+                        chunk._text = None
+                        continue
+                    if chunk._parts is None:
+                        chunk._parts = chunk._render_parts()
+                    chunk._clean = True
+                    stack.append(iter(chunk._parts))
+                    break
+                chunks.append(chunk)
+            else:
+                stack.pop()
+        self._text = "".join(chunks)
+
+    def _render_parts(self):
+        """Render the lines of this section, return them joined up to each of its sections."""
+        indents = INDENTS
+        parts = []
+        lines = []
+        for level, chunk in zip(self.levels, self.code):
+            if isinstance(chunk, CodeEmitter):
+                if lines:
+                    parts.append("".join(lines))
+                    lines = []
+                parts.append(chunk)
+            else:
+                lines.append(f"{indents[level]}{chunk}\n")
+        if lines:
+            parts.append("".join(lines))
+        return parts
+
+    def _changed(self):
+        """Mark this section as changed, and it and its parents as needing to be rendered.
+
+        Parents of a section needing to be rendered always do too, so
+        this stops at the first one which already does."""
+        self._parts = None
+        section = self
+        while section is not None and section._clean:
+            section._clean = False
+            section._text = None
+            section = section.parent
+
+    def _lines(self):
+        indents = INDENTS
+        for level, chunk in zip(self.levels, self.code):
+            if isinstance(chunk, CodeEmitter):
+                yield chunk
+            else:
+                yield indents[level]
+                yield chunk
+                yield "\n"
+
+    def iter_chunks(self):
+        """Yield the code as a sequence of string fragments.
 
-    def add_line(self, line):
+        Sections are walked iteratively, with an explicit stack, so
+        sections may be nested arbitrarily deep without hitting the
+        recursion limit, and no intermediate string is built per section.
+        The lines of sections rendered before, and unchanged since, are
+        yielded as rendered."""
+        stack = [iter((self,))]
+        while stack:
+            for chunk in stack[-1]:
+                if isinstance(chunk, CodeEmitter):
+                    if chunk._text is not None:
+                        yield chunk._text
+                        continue
+                    stack.append(iter(chunk._parts) if chunk._parts is not None else chunk._lines())
+                    break
+                yield chunk
+            else:
+                stack.pop()
+
+    def write_to(self, fileobj):
+        """Write the code to the (text) file object `fileobj`.
+
+        Fragments are written in batches of about WRITE_SIZE characters,
+        the code is never held in memory as a whole."""
+        batch = []
+        size = 0
+        for chunk in self.iter_chunks():
+            batch.append(chunk)
+            size += len(chunk)
+            if size >= self.WRITE_SIZE:
+                fileobj.write("".join(batch))
+                batch = []
+                size = 0
+        if batch:
+            fileobj.write("".join(batch))
+
+    def add_line(self, line, origin=None):
         """Add a line of code.
 
+        `origin` optionally records what generated the line, e.g. a
+        template's name and offset or `sourcemap.caller_origin()`, see
+        `source_map`.
+
         NOTE: indentation and newline is automatically handled.
               Do not add this yourself."""
-        self.code.extend([" " * self.indent_level, line, '\n'])
+        self.code.append(line)
+        self.levels.append(self.indent_level)
+        if origin is not None and self.origins is None:
+            self.origins = [None] * (len(self.code) - 1)
+            section = self
+            while section is not None and not section.mapped:
+                section.mapped = True
+                section = section.parent
+        if self.origins is not None:
+            self.origins.append(origin)
+        self._changed()
 
     def add_section(self):
         """Add a section. An extensible placeholder for additional code.
@@ -27,8 +227,12 @@ class CodeEmitter(object):
         Adds a new CodeEmitter instance to this point in the code generator.
         The CodeEmitter instance effectively works as an extensible placeholder.
         Good for adding bodies to control-blocks or functions."""
-        section = CodeEmitter(self.indent_level)
+        section = CodeEmitter(self.indent_level, parent=self)
         self.code.append(section)
+        self.levels.append(self.indent_level)
+        if self.origins is not None:
+            self.origins.append(None)
+        self._changed()
         return section
 
     def indent(self):
@@ -38,6 +242,7 @@ class CodeEmitter(object):
         Calling this after adding code after which follows a block of
         code (for/while/with/def) is essential."""
         self.indent_level += self.INDENT_STEP
+        self._changed()
 
     def dedent(self):
         """Decrease indentation level for subsequently added lines by one.
@@ -45,14 +250,44 @@ class CodeEmitter(object):
         The opposite of `indent`. Used to mark the end of a code block
         pertaining to a for/while/with/def/... block."""
         self.indent_level -= self.INDENT_STEP
+        self._changed()
 
-    def evaluate(self):
+    def source_map(self):
+        """Return the origin of each line of the rendered code, None if no origins were recorded.
+
+        Lines added without an origin map to None."""
+        if not self.mapped:
+            return None
+        origins = []
+        stack = [zip(self.code, self.origins or repeat(None))]
+        while stack:
+            for chunk, origin in stack[-1]:
+                if isinstance(chunk, CodeEmitter):
+                    if not chunk.mapped:
+                        origins.extend(repeat(None, str(chunk).count("\n")))
+                        continue
+                    stack.append(zip(chunk.code, chunk.origins or repeat(None)))
+                    break
+                origins.extend(repeat(origin, chunk.count("\n") + 1))
+            else:
+                stack.pop()
+        return origins
+
+    def evaluate(self, env=None, cache=None):
         """Evaluate the code (and sub-sections), returns the env as a dict.
 
         Evaluates the code contained in this instance (and its sub-sections)
         and returns the resulting environment as a dictionary.
         The environment essentially captures the global values defined by
         evaluating the code and its entries may have data or code values.
+
+        The code is evaluated in `env` if given, a globals dict which may be
+        reused between evaluations, or else in a new one. The code is
+        compiled through compile_source(), `cache` is an optional
+        DiskCodeCache to keep the compiled code in.
+
+        The code is compiled under a pseudo-filename and registered with
+        linecache, along with its source map, see `sourcemap`.
         """
         assert self.indent_level == 0, "CodeEmitter instance have unfinished blocks (indent_level == {})".format(
             self.indent_level)
@@ -60,6 +295,9 @@ class CodeEmitter(object):
         source_code = str(self)
 
         # execute the code, return the defined global values
-        env = {}
-        exec(source_code, env)
+        if env is None:
+            env = {}
+        code = compile_source(source_code, cache=cache)
+        sourcemap.register(code.co_filename, source_code, self.source_map(), code)
+        exec(code, env)
         return env
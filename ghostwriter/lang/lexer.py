@@ -4,10 +4,21 @@ Implement a Lexer.
 
 Note the lexer has considerable code duplication in favour of remaining as
 fast as I can reasonably make it.
+
+The *_while/*_until methods accept either a string or a precompiled
+`CharClass` as their alphabet. Prefer building CharClass instances once
+at module level for alphabets which are used repeatedly.
 """
 import attr
-from .token import Token, TokenType
-
+import codecs
+import io
+import mmap
+import re
+import typing as t
+from functools import lru_cache
+from .charclass import Alphabet, CharClass, charclass  # noqa: F401
+from .lineindex import LineIndex
+from .token import LazyToken, Token, TokenSource, TokenType  # noqa: F401
 
 # TODO
 # 0) test existing methods
@@ -23,12 +34,14 @@ from .token import Token, TokenType
 # changed before emit()/ignore()
 
 class LexerError(Exception):
-    __attrs__ = ['pos', 'eof', 'buf', 'bufcursor', 'message']
+    __attrs__ = ['pos', 'line', 'col', 'eof', 'buf', 'buf_start', 'buf_cursor', 'message']
 
     def __init__(self, lexer, message):
         self.pos = lexer.pos
+        self.line, self.col = lexer.line_col(self.pos) if lexer.lines is not None else (None, None)
         self.eof = lexer.eof
         self.buf = lexer.buf
+        self.buf_start = lexer.buf_start
         self.buf_cursor = lexer.buf_cursor
 
         self.message = message
@@ -71,37 +84,141 @@ class LexerExpectError(LexerError):
         self.__attrs__ = [*self.__attrs__, 'expected', 'actual', 'diverges_at']
 
 
-def lex_file(fname):
-    stream = open(fname, 'r+', 32768)
-    return Lexer(stream=stream)
+# minimum number of characters to read from a stream when refilling the buffer
+READ_SIZE = 32768
+
+
+# sources which are used directly as the lexer's buffer
+BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
 
 
-def seekable_stream(_, attribute, val):
-    if not hasattr(val, 'seekable') or not callable(val.seekable):
+def readable_stream(_, attribute, val):
+    if isinstance(val, BUFFER_TYPES):
+        return
+    if not hasattr(val, 'read') or not callable(val.read):
         raise ValueError(f"'{attribute.name}' not a stream object!")
-    if not val.seekable():
-        raise ValueError(f"'{attribute.name}' is not a seekable stream!")
+
+
+def _exhausted(size: int) -> str:
+    return ""
+
+
+@lru_cache(maxsize=64)
+def _literal_search(seq: bytes):
+    return re.compile(re.escape(seq)).search
+
+
+def _find_bytes(buf, seq: bytes, start: int) -> int:
+    """
+    bytes.find() for any bytes-like buffer (memoryviews have no find())
+    """
+    match = _literal_search(seq)(buf, start)
+    return match.start() if match else -1
 
 
 @attr.s(slots=True)
 class Lexer:
-    stream = attr.ib(validator=seekable_stream, repr=False)
-
-    # the buffer (`buf`), its size (`buf_len`) and the current offset within it (`buf_cursor`)
+    """
+    Lexer reading from a text or binary stream, or from a buffer.
+
+    Streams are read in chunks into `buf`. Each read is at least as large as
+    the text retained since the last emit()/ignore(), so that tokens spanning
+    much of the input are buffered in amortised linear time rather than by
+    re-copying the buffer for every line. Buffers (bytes, bytearray,
+    memoryview or mmap.mmap) are used directly as `buf`.
+
+    Binary input (buffers and binary streams) is lexed without decoding it up
+    front: positions are byte offsets and only the strings the lexer returns,
+    such as token literals, are decoded using `encoding`. The encoding must be
+    ASCII-compatible, as must any alphabet or sequence the lexer scans for.
+
+    Streams are only ever read forwards, so they need not be seekable (pipes,
+    stdin, sockets). Only the input since the last emit()/ignore() is kept
+    buffered, and binary streams are read with read1() where available, so
+    tokens are produced as soon as the input for them has arrived. Pass
+    `track_lines=False` to also forgo the (small, but growing) line index.
+    """
+    stream = attr.ib(validator=readable_stream, repr=False)
+    encoding = attr.ib(type=str, default="utf-8", kw_only=True)
+    read_size = attr.ib(type=int, default=READ_SIZE, kw_only=True)
+    # emit LazyTokens, which only slice their literal from the buffer when read
+    lazy = attr.ib(type=bool, default=False, kw_only=True)
+    track_lines = attr.ib(type=bool, default=True, kw_only=True)
+
+    # the buffer (`buf`), its size (`buf_len`), the offset where the current
+    # token starts (`buf_start`) and the current offset within it (`buf_cursor`)
+    # Text before `buf_start` is only dropped when the buffer is next refilled.
     buf = attr.ib(init=False, type=str, default="")
     buf_len = attr.ib(init=False, type=int, default=0)
+    buf_start = attr.ib(init=False, type=int, default=0)
     buf_cursor = attr.ib(init=False, type=int, default=0)
     eof = attr.ib(init=False, type=bool, default=False)
 
+    # True if `buf` holds bytes which must be decoded
+    binary = attr.ib(init=False, type=bool, default=False)
+    # True if `encoding` is UTF-8, see _chars()
+    utf8 = attr.ib(init=False, type=bool, default=False)
+
     # offset within underlying buffer (uses stream.tell() )
     pos = attr.ib(init=False)
 
+    # where each line of the input starts, see line_col(). None if not tracked
+    lines = attr.ib(init=False, repr=False, default=None)
+
+    _read = attr.ib(init=False, repr=False)
+    # what lazy tokens slice from, replaced whenever `buf` is
+    _token_src = attr.ib(init=False, repr=False, default=None)
+    # input position from which input is kept buffered for restore(), if any
+    _saved_pos = attr.ib(init=False, repr=False, default=None)
+
     def __attrs_post_init__(self):
         self.pos = 0
         self.eof = False
+        if self.track_lines:
+            self.lines = LineIndex()
+        self.utf8 = codecs.lookup(self.encoding).name == "utf-8"
+        stream = self.stream
+        if isinstance(stream, BUFFER_TYPES):
+            # the whole input is already in memory, never refill
+            if isinstance(stream, memoryview) and stream.format != 'B':
+                stream = stream.cast('B')
+            self.buf = stream
+            self.buf_len = len(stream)
+            self.binary = True
+            self._read = _exhausted
+        else:
+            self.binary = isinstance(stream, (io.RawIOBase, io.BufferedIOBase))
+            if self.binary:
+                self.buf = b""
+                # don't block until a full chunk has arrived from a pipe
+                self._read = getattr(stream, 'read1', stream.read)
+            else:
+                self._read = stream.read
 
     def close(self) -> None:
-        self.stream.close()
+        try:
+            self.stream.close()
+        except BufferError:
+            # lazy tokens still slice their literals from the mapping (see emit()),
+            # it is unmapped once they are gone
+            pass
+
+    def line_col(self, pos: t.Optional[int] = None) -> t.Tuple[int, int]:
+        """
+        Return the (line, column) of input position `pos`, both counting from 1.
+
+        `pos` defaults to the current position, token positions (`startpos`)
+        work as well. Columns count bytes for binary input.
+        """
+        if pos is None:
+            pos = self.pos
+        lines = self.lines
+        if lines is None:
+            raise RuntimeError("line tracking is disabled for this lexer")
+        if self._read is _exhausted and lines.indexed < pos:
+            # buffers are not read in chunks, index them as far as needed
+            lines.feed(self.buf, lines.indexed, min(pos, self.buf_len))
+        return lines.line_col(pos)
 
     def error(self, message: str) -> None:
         raise LexerError(self, message)
@@ -118,233 +235,276 @@ class Lexer:
             raise LexerExpectError(self, seq, actual, message)
         return seq
 
+    def _text(self, start: int, end: int) -> str:
+        if self.binary:
+            return str(self.buf[start:end], self.encoding)
+        return self.buf[start:end]
+
+    def _chars(self, start: int, end: int) -> str:
+        """
+        _text() for next() and peek(), which count bytes for binary input.
+
+        For binary input, `start` or `end` may fall within a (multi-byte)
+        character. A UTF-8 character split at `end` is returned whole, the
+        cursor is not moved past it though. Any other partial character is
+        replaced by U+FFFD rather than raising, such text only serves to be
+        compared against sequences. Emitted literals are decoded strictly.
+        """
+        if not self.binary:
+            return self.buf[start:end]
+        if self.utf8 and start < end and self.buf[end - 1] >= 0x80:
+            if end + 3 > self.buf_len:
+                # the rest of the character may not have been read yet
+                cur = self.buf_cursor
+                self._fill(end - cur + 3)
+                start += self.buf_cursor - cur
+                end += self.buf_cursor - cur
+            buf = self.buf
+            limit = min(end + 3, self.buf_len)
+            while end < limit and buf[end] & 0xC0 == 0x80:
+                end += 1
+        return str(self.buf[start:end], self.encoding, "replace")
+
+    def _extend(self, chunks: t.List[t.AnyStr]) -> int:
+        """
+        Append `chunks` to the buffer, dropping everything before the current
+        token (or the position saved by save(), if earlier).
+
+        Returns the number of characters dropped, by which any offset into
+        the old buffer must be adjusted.
+        """
+        if self.lines is not None:
+            for chunk in chunks:
+                self.lines.feed(chunk)
+        start = self.buf_start
+        if self._saved_pos is not None:
+            start = min(start, self.buf_cursor - (self.pos - self._saved_pos))
+        self.buf = (b"" if self.binary else "").join([self.buf[start:], *chunks])
+        self.buf_len = len(self.buf)
+        self.buf_start -= start
+        self.buf_cursor -= start
+        self._token_src = None
+        return start
+
+    def _fill(self, n: int) -> int:
+        """
+        Read until at least `n` characters are buffered past the cursor or EOF is reached.
+
+        Returns the number of characters buffered past the cursor.
+        """
+        buffered = self.buf_len - self.buf_cursor
+        retained = self.buf_len - self.buf_start
+        chunks = []
+        while buffered < n:
+            chunk = self._read(max(self.read_size, n - buffered, retained))
+            if not chunk:  # EOF
+                break
+            buffered += len(chunk)
+            retained += len(chunk)
+            chunks.append(chunk)
+        if chunks:
+            self._extend(chunks)
+        return buffered
+
     def next(self, n: int = 1) -> str:
         cur = self.buf_cursor
 
         buffered = self.buf_len - cur
         if buffered >= n:
             # can satisfy request from buffer
-            result = self.buf[cur:cur + n]
             self.buf_cursor += n
             self.pos += n
-            return result
+            return self._chars(cur, cur + n)
 
         # only partial or nothing in buffer
-        chunks = [self.buf]
-        while buffered < n:
-            line = self.stream.readline()
-            if line == "":  # EOF
-                self.eof = True
-                break
-            buffered += len(line)
-            chunks.append(line)
-        self.buf = "".join(chunks)
-        self.buf_len = buffered + cur
-
+        buffered = self._fill(n)
+        if buffered < n:
+            self.eof = True
         to_read = min(buffered, n)
+        cur = self.buf_cursor
         self.buf_cursor += to_read
         self.pos += to_read
-        return self.buf[cur:cur + to_read]
-
-    def next_while(self, alphabet: str) -> str:
-        if isinstance(alphabet, str):
-            alphabet = list(alphabet)
-
-        # first try using just what is buffered
-        buf1 = self.buf[self.buf_cursor:]
-        for n, c in enumerate(buf1):
-            if c not in alphabet:
-                self.buf_cursor += n
-                self.pos += n
-                return buf1[:n]
-
-        # ... then go through the stream, building up an ever larger buffer as
-        # we do. => need to write the new buffer back into the lex object.
-        bufs = []
-        while True:
-            buf = self.stream.readline()
-            if buf == "":
-                break
-            for n, c in enumerate(buf):
-                if c not in alphabet:
-                    self.buf = "".join([self.buf, *bufs, buf])
-                    self.buf_len = len(self.buf)
-                    result = "".join([buf1, *bufs, buf[:n]])
-                    consumed = len(result)
-
-                    self.buf_cursor += consumed
-                    self.pos += consumed
-                    return result
-            bufs.append(buf)
+        return self._chars(cur, cur + to_read)
 
-        # Finally, handle EOF scenarios where our pattern matched
-        # everything until the end of the stream (EOF)
-        self.eof = True
-        self.buf = "".join([self.buf, *bufs])
-        self.buf_len = len(self.buf)
-        result = "".join([buf1, *bufs])
-        consumed = len(result)
-
-        self.buf_cursor += consumed
-        self.pos += consumed
-        return result
-
-    def next_until(self, alphabet: str) -> str:
-        # IDENTICAL to nextWhile except the breaking condition
-        # 'not c in alphabet' (while) => 'c in alphabet' (until)
-        if isinstance(alphabet, str):
-            alphabet = list(alphabet)
-
-        # first try using just what is buffered
-        buf1 = self.buf[self.buf_cursor:]
-        for n, c in enumerate(buf1):
-            if c in alphabet:
-                self.buf_cursor += n
-                self.pos += n
-                return buf1[:n]
-
-        # ... then go through the stream, building up an ever larger buffer as
-        # we do. => need to write the new buffer back into the lex object.
+    def _scan(self, cc: CharClass, until: bool, consume: bool) -> int:
+        """
+        Match `cc` from the cursor onwards, reading more of the stream for
+        as long as the match extends to the end of the buffer.
+
+        Returns the offset within `buf` at which the match ends. Only sets
+        EOF if `consume` is true, peeking never does.
+        """
+        if self.binary:
+            span = cc.bspan_until if until else cc.bspan_while
+            if span is None:
+                raise ValueError(f"cannot scan binary input for non-ASCII alphabet {cc!r}")
+        else:
+            span = cc.span_until if until else cc.span_while
+
+        end = span(self.buf, self.buf_cursor).end()
+        if end < self.buf_len:
+            return end
+
+        # ... then go through the stream, scanning each chunk as it is read
+        # and joining it all into the new buffer once the match ends.
+        retained = self.buf_len - self.buf_start
         bufs = []
         while True:
-            buf = self.stream.readline()
-            if buf == "":
+            buf = self._read(max(self.read_size, retained))
+            if not buf:
+                # Finally, handle EOF scenarios where our pattern matched
+                # everything until the end of the stream (EOF)
+                if consume:
+                    self.eof = True
                 break
-            for n, c in enumerate(buf):
-                if c in alphabet:
-                    self.buf = "".join([self.buf, *bufs, buf])
-                    self.buf_len = len(self.buf)
-                    result = "".join([buf1, *bufs, buf[:n]])
-                    consumed = len(result)
-
-                    self.buf_cursor += consumed
-                    self.pos += consumed
-                    return result
             bufs.append(buf)
+            retained += len(buf)
+            n = span(buf).end()
+            end += n
+            if n != len(buf):
+                break
+        if bufs:
+            end -= self._extend(bufs)
+        return end
 
-        # Finally, handle EOF scenarios where our pattern matched
-        # everything until the end of the stream (EOF)
-        self.eof = True
-        self.buf = "".join([self.buf, *bufs])
-        self.buf_len = len(self.buf)
-        result = "".join([buf1, *bufs])
-        consumed = len(result)
-
-        self.buf_cursor += consumed
-        self.pos += consumed
-        return result
-
-    def next_until_seq(self, seq: str) -> str:
-        first = seq[0]
-        seq_len = len(seq)
-        out = []
-        while True:
-            out.append(self.next_until(first))
-            if self.peek(seq_len) == seq:
-                return "".join(out)
-            out.append(self.next(1))
-            if self.eof:
-                return "".join(out)
+    def next_while(self, alphabet: Alphabet) -> str:
+        end = self._scan(charclass(alphabet), False, True)
+        cur = self.buf_cursor
+        self.buf_cursor = end
+        self.pos += end - cur
+        return self._text(cur, end)
 
-    def peek(self, n: int = 1) -> str:
+    def next_until(self, alphabet: Alphabet) -> str:
+        end = self._scan(charclass(alphabet), True, True)
         cur = self.buf_cursor
+        self.buf_cursor = end
+        self.pos += end - cur
+        return self._text(cur, end)
 
-        buffered = self.buf_len - cur
-        if buffered >= n:
-            return self.buf[cur:cur + n]
+    def skip_while(self, alphabet: Alphabet) -> int:
+        """
+        Like next_while, but return the number of characters skipped
+        rather than slicing (and, for binary input, decoding) them.
+        """
+        end = self._scan(charclass(alphabet), False, True)
+        n = end - self.buf_cursor
+        self.buf_cursor = end
+        self.pos += n
+        return n
 
-        chunks = [self.buf]
-        while buffered < n:
-            line = self.stream.readline()
-            if line == "":  # EOF
-                break
-            buffered += len(line)
-            chunks.append(line)
-        self.buf = "".join(chunks)
-        self.buf_len = buffered + cur  # == len(self.buf)
+    def _find(self, seq: str) -> int:
+        """
+        Find `seq` from the cursor onwards, reading more of the stream until
+        it is found or EOF is reached (which sets EOF).
 
-        if buffered < n:
-            return self.buf[cur:]
-        # not EOF, only return subsection fitting requested amount
-        return self.buf[cur:cur + n]
-
-    def peek_while(self, alphabet: str) -> str:
-        if isinstance(alphabet, str):
-            alphabet = list(alphabet)
-
-        # first try using just what is buffered
-        buf1 = self.buf[self.buf_cursor:]
-        for n, c in enumerate(buf1):
-            if c not in alphabet:
-                return buf1[:n]
-
-        # ... then go through the stream, building up an ever larger buffer as
-        # we do. => need to write the new buffer back into the lex object.
-        bufs = []
+        Returns the offset of `seq` within `buf`, or `buf_len` if not found.
+        """
+        if self.binary:
+            seq = seq.encode(self.encoding)
+            find = _find_bytes
+        else:
+            find = str.find
+        ndx = find(self.buf, seq, self.buf_cursor)
+        if ndx != -1:
+            return ndx
+
+        # ... then search each chunk as it is read, prefixed by the tail of
+        # what came before in case `seq` straddles the boundary. The chunks
+        # are only joined into the buffer once, when done.
+        keep = len(seq) - 1
+        tail = self.buf[max(self.buf_cursor, self.buf_len - keep):self.buf_len]
+        retained = self.buf_len - self.buf_start
+        chunks = []
         while True:
-            buf = self.stream.readline()
-            if buf == "":
-                break
-            for n, c in enumerate(buf):
-                if c not in alphabet:
-                    self.buf = "".join([self.buf, *bufs, buf])
-                    self.buf_len = len(self.buf)
-                    result = "".join([buf1, *bufs, buf[:n]])
-
-                    return result
-            bufs.append(buf)
-
-        # Finally, handle EOF scenarios where our pattern matched
-        # everything until the end of the stream (EOF)
-        # (But do NOT set EOF, we are peeking)
-        self.buf = "".join([self.buf, *bufs])
-        self.buf_len = len(self.buf)
-        result = "".join([buf1, *bufs])
+            chunk = self._read(max(self.read_size, retained))
+            if not chunk:
+                self.eof = True
+                if chunks:
+                    self._extend(chunks)
+                return self.buf_len
+            retained += len(chunk)
+            chunks.append(chunk)
+            searched = tail + chunk
+            ndx = find(searched, seq, 0)
+            if ndx != -1:
+                self._extend(chunks)
+                return self.buf_len - len(searched) + ndx
+            tail = searched[len(searched) - keep:] if keep else chunk[:0]
 
-        return result
+    def next_until_seq(self, seq: str) -> str:
+        end = self._find(seq)
+        cur = self.buf_cursor
+        self.buf_cursor = end
+        self.pos += end - cur
+        return self._text(cur, end)
 
-    def peek_until(self, alphabet: str) -> str:
-        # IDENTICAL to peekWhile except the breaking condition
-        # 'not c in alphabet' (while) => 'c in alphabet' (until)
-        if isinstance(alphabet, str):
-            alphabet = list(alphabet)
+    def skip_until_seq(self, seq: str) -> int:
+        """
+        Like next_until_seq, but return the number of characters skipped
+        rather than slicing them out of the buffer.
+        """
+        end = self._find(seq)
+        n = end - self.buf_cursor
+        self.buf_cursor = end
+        self.pos += n
+        return n
 
-        # first try using just what is buffered
-        buf1 = self.buf[self.buf_cursor:]
-        for n, c in enumerate(buf1):
-            if c in alphabet:
-                return buf1[:n]
+    def peek(self, n: int = 1) -> str:
+        cur = self.buf_cursor
 
-        # ... then go through the stream, building up an ever larger buffer as
-        # we do. => need to write the new buffer back into the lex object.
-        bufs = []
-        while True:
-            buf = self.stream.readline()
-            if buf == "":
-                break
-            for n, c in enumerate(buf):
-                if c in alphabet:
-                    self.buf = "".join([self.buf, *bufs, buf])
-                    self.buf_len = len(self.buf)
-                    result = "".join([buf1, *bufs, buf[:n]])
+        buffered = self.buf_len - cur
+        if buffered >= n:
+            return self._chars(cur, cur + n)
 
-                    return result
-            bufs.append(buf)
+        buffered = self._fill(n)
+        cur = self.buf_cursor
+        # only return subsection fitting requested amount, if not at EOF
+        return self._chars(cur, cur + min(buffered, n))
 
-        # Finally, handle EOF scenarios where our pattern matched
-        # everything until the end of the stream (EOF)
-        # (But do NOT set EOF, we are peeking)
-        self.buf = "".join([self.buf, *bufs])
-        self.buf_len = len(self.buf)
-        result = "".join([buf1, *bufs])
+    def peek_while(self, alphabet: Alphabet) -> str:
+        end = self._scan(charclass(alphabet), False, False)
+        return self._text(self.buf_cursor, end)
 
-        return result
+    def peek_until(self, alphabet: Alphabet) -> str:
+        end = self._scan(charclass(alphabet), True, False)
+        return self._text(self.buf_cursor, end)
 
     def current(self) -> str:
         """
         Return literal value of token if one was emitted right now
         """
-        return self.buf[:self.buf_cursor]
+        return self._text(self.buf_start, self.buf_cursor)
+
+    def save(self) -> t.Tuple[int, bool]:
+        """
+        Return the lexer's state, to restore() it later.
+
+        The lexer must be at a token boundary (just after emit()/ignore()).
+        Input from this point on stays buffered until release() is called,
+        regardless of what is emitted or ignored in the meantime.
+        """
+        if self.buf_cursor != self.buf_start:
+            raise RuntimeError("can only save the lexer state right after emit()/ignore()")
+        self._saved_pos = self.pos
+        return self.pos, self.eof
+
+    def restore(self, state: t.Tuple[int, bool]) -> None:
+        """
+        Return to a state previously returned by save().
+        """
+        pos, eof = state
+        if self._saved_pos is None or not self._saved_pos <= pos <= self.pos:
+            raise RuntimeError("cannot restore a state which is no longer buffered")
+        self.buf_cursor -= self.pos - pos
+        self.buf_start = self.buf_cursor
+        self.pos = pos
+        self.eof = eof
+
+    def release(self) -> None:
+        """
+        Stop keeping input buffered for restore().
+        """
+        self._saved_pos = None
 
     def rewind(self, n=1) -> None:
         """
@@ -352,7 +512,7 @@ class Lexer:
 
         NOTE: cannot revert beyond point of last call to emit()/ignore()
         """
-        if n > self.buf_cursor:
+        if n > self.buf_cursor - self.buf_start:
             raise RuntimeError("cannot rewind beyond what is buffered!")
         self.buf_cursor -= n
         self.pos -= n
@@ -361,34 +521,53 @@ class Lexer:
         """
         Discard everything read since last emitting a token/calling ignore()
         """
-        unread = self.buf_len - self.buf_cursor
-        if unread == 0:
-            self.buf = ""
-            self.buf_len = 0
-            self.buf_cursor = 0
-        else:
-            new_buf = self.buf[-unread:]
-            self.buf = new_buf
-            self.buf_len = unread
-            self.buf_cursor = 0
+        self.buf_start = self.buf_cursor
 
     def emit(self, typ: TokenType) -> Token:
         """
         Emit new token using currently read literal value.
-        """
-        unread = self.buf_len - self.buf_cursor
-        if unread != 0:
-            literal = self.buf[:self.buf_cursor]
-            tok = Token(type=typ, literal=literal, startpos=self.pos - len(literal))
-
-            new_buf = self.buf[-unread:]
-            self.buf = new_buf
-            self.buf_len = unread
-            self.buf_cursor = 0
-        else:
-            tok = Token(type=typ, literal=self.buf, startpos=self.pos - len(self.buf))
 
-            self.buf = ""
-            self.buf_len = 0
-            self.buf_cursor = 0
-        return tok
+        The literal is sliced from the buffer here and nowhere else - or,
+        for lazy lexers, when the token's literal is first accessed.
+        """
+        start = self.buf_start
+        cur = self.buf_cursor
+        self.buf_start = cur
+        if self.lazy:
+            src = self._token_src
+            if src is None:
+                buf = self.buf
+                if isinstance(buf, mmap.mmap):
+                    # pins the mapping, so the tokens remain readable after close()
+                    buf = memoryview(buf)
+                src = self._token_src = TokenSource(buf, self.pos - cur, self.encoding if self.binary else None)
+            return LazyToken(type=typ, literal=src, startpos=self.pos - (cur - start), len=cur - start)
+        return Token(type=typ, literal=self._text(start, cur), startpos=self.pos - (cur - start))
+
+
+def lex_file(fname: str, mapped: bool = False, binary: bool = False, encoding: str = "utf-8",
+             **kwargs) -> "Lexer":
+    """
+    Open a Lexer on the contents of file `fname`.
+
+    If `mapped` is set, the file is memory-mapped rather than read into the
+    lexer's buffer. The lexer then scans the mapped region
+    directly and only decodes (using `encoding`) what it returns, such as
+    token literals - so memory usage stays flat regardless of file size.
+    Lazy tokens keep the mapping alive, so they can be read after close().
+
+    If `binary` is set, the file is read in binary mode, also deferring
+    decoding to the point where the lexer returns a string.
+
+    Any other keyword arguments (e.g. `lazy`) are passed on to the Lexer.
+    """
+    if binary and not mapped:
+        return Lexer(stream=open(fname, 'rb', READ_SIZE), encoding=encoding, **kwargs)
+    if not mapped:
+        return Lexer(stream=open(fname, 'r', READ_SIZE, encoding=encoding), **kwargs)
+    with open(fname, 'rb') as fh:
+        try:
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files cannot be mapped
+            return Lexer(stream=b"", encoding=encoding, **kwargs)
+    return Lexer(stream=buf, encoding=encoding, **kwargs)
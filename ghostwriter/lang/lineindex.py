@@ -0,0 +1,43 @@
+"""
+
+Map input positions to (line, column) pairs.
+
+The index records the position at which each line starts in a compact
+array, built incrementally as the lexer reads its input, so lookups are a
+binary search rather than a rescan of the input.
+"""
+import attr
+import re
+import typing as t
+from array import array
+from bisect import bisect_right
+
+_NEWLINE = re.compile("\n")
+_NEWLINE_BYTES = re.compile(b"\n")
+
+
+@attr.s(slots=True)
+class LineIndex:
+    # start position of each line, the first line starts at 0
+    starts = attr.ib(init=False, repr=False, factory=lambda: array('q', [0]))
+    # input position up to which line starts have been recorded
+    indexed = attr.ib(init=False, type=int, default=0)
+
+    def feed(self, buf, start: int = 0, end: t.Optional[int] = None) -> None:
+        """
+        Record the lines starting in `buf[start:end]`, which must be the
+        input following what has been indexed so far.
+        """
+        if end is None:
+            end = len(buf)
+        newline = _NEWLINE if isinstance(buf, str) else _NEWLINE_BYTES
+        base = self.indexed - start
+        self.starts.extend(m.end() + base for m in newline.finditer(buf, start, end))
+        self.indexed += end - start
+
+    def line_col(self, pos: int) -> t.Tuple[int, int]:
+        """
+        Return the (line, column) of input position `pos`, both counting from 1.
+        """
+        line = bisect_right(self.starts, pos)
+        return line, pos - self.starts[line - 1] + 1
@@ -0,0 +1,232 @@
+"""
+
+Map the lines of generated code back to what generated them.
+
+CodeEmitter.evaluate() compiles code under a pseudo-filename derived from
+its source, and registers the source with linecache so that tracebacks,
+pdb and profilers show the generated lines. Lines added with an origin
+(e.g. a template's name and offset, or caller_origin()) have their origin
+registered here as well, by generated line number. A source registered
+along with its code stays registered for as long as any of the code is alive.
+
+fold_stats() then attributes cProfile results to those origins. Profilers
+report each function at the line it is defined on, so time is attributed
+to the origin of the generated function's first line. LineProfiler instead
+times each line of generated code run, for the origin of every line.
+"""
+import attr
+import hashlib
+import linecache
+import pstats
+import sys
+import time
+import types
+import typing as t
+import weakref
+
+# where a line was generated from, e.g. ("page.moustache", 120)
+Origin = t.Hashable
+
+# filename: the origin of each line of the source registered under it
+_origins: t.Dict[str, t.List[t.Optional[Origin]]] = {}
+# filename: the number of code objects compiled from it which are alive, see register()
+_live: t.Dict[str, int] = {}
+# ids of the code objects counted in _live
+_tracked: t.Set[int] = set()
+
+
+def source_digest(source: str) -> bytes:
+    return hashlib.sha256(source.encode("utf-8", "surrogatepass")).digest()
+
+
+def source_filename(source: str, digest: t.Optional[bytes] = None) -> str:
+    """
+    Return the pseudo-filename to compile `source` under, the same for the same source.
+
+    `digest` is the source_digest() of `source`, if already known.
+    """
+    if digest is None:
+        digest = source_digest(source)
+    return f"<generated {digest.hex()[:16]}>"
+
+
+def register(filename: str, source: str, origins: t.Optional[t.List[t.Optional[Origin]]] = None,
+             code: t.Optional[types.CodeType] = None) -> None:
+    """
+    Register `source` with linecache under `filename`, and the origin of each of its lines if given.
+
+    If the `code` compiled from `source` is given, the source is unregistered
+    once that code, and the code of the functions it defines, is garbage
+    collected. Otherwise it stays registered until unregister().
+    """
+    if filename not in linecache.cache:
+        # no modification time, so linecache.checkcache() keeps the entry
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    if origins is not None:
+        _origins[filename] = origins
+    else:
+        _origins.pop(filename, None)
+    if code is not None:
+        _track(filename, code)
+
+
+def unregister(filename: str) -> None:
+    """
+    Forget the source (and origins) registered under `filename`.
+    """
+    _origins.pop(filename, None)
+    linecache.cache.pop(filename, None)
+
+
+def _track(filename: str, code: types.CodeType) -> None:
+    codes = [code]
+    while codes:
+        code = codes.pop()
+        if id(code) in _tracked:
+            continue
+        _tracked.add(id(code))
+        _live[filename] = _live.get(filename, 0) + 1
+        weakref.finalize(code, _released, filename, id(code))
+        codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+
+
+def _released(filename: str, code_id: int) -> None:
+    _tracked.discard(code_id)
+    live = _live[filename] - 1
+    if live:
+        _live[filename] = live
+    else:
+        del _live[filename]
+        unregister(filename)
+
+
+def origin(filename: str, lineno: int) -> t.Optional[Origin]:
+    """
+    Return the origin of line `lineno` (counting from 1) of generated code `filename`, if known.
+    """
+    origins = _origins.get(filename)
+    if origins is None or not 0 < lineno <= len(origins):
+        return None
+    return origins[lineno - 1]
+
+
+def caller_origin(depth: int = 1) -> t.Tuple[str, int]:
+    """
+    Return the (filename, line number) of the code calling the caller of this function.
+
+    Pass `depth` > 1 to look further up the stack, e.g. past helper functions.
+    """
+    frame = sys._getframe(depth + 1)
+    return frame.f_code.co_filename, frame.f_lineno
+
+
+@attr.s(slots=True)
+class OriginStats:
+    calls = attr.ib(type=int, default=0)
+    # time spent in the functions themselves
+    tottime = attr.ib(type=float, default=0.0)
+    # time including their callees, counted once per function (it may overlap)
+    cumtime = attr.ib(type=float, default=0.0)
+
+
+def fold_stats(stats: t.Any) -> t.Dict[Origin, OriginStats]:
+    """
+    Sum the profile of the generated functions by their origins.
+
+    `stats` is a pstats.Stats or a cProfile.Profile. Functions of code
+    without registered origins are left out.
+    """
+    if not isinstance(stats, pstats.Stats):
+        stats = pstats.Stats(stats)
+    folded: t.Dict[Origin, OriginStats] = {}
+    for (filename, lineno, _), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        where = origin(filename, lineno)
+        if where is None:
+            continue
+        entry = folded.get(where)
+        if entry is None:
+            entry = folded[where] = OriginStats()
+        entry.calls += calls
+        entry.tottime += tottime
+        entry.cumtime += cumtime
+    return folded
+
+
+@attr.s(slots=True)
+class LineProfiler:
+    """
+    Time the lines of registered generated code run, by their origins.
+
+    Use it as a context manager around the code to profile, then read
+    `stats`: `calls` counts the times the lines ran, `tottime` is the time
+    spent in them, including functions they call other than generated code,
+    `cumtime` includes generated code as well. Only functions called in the
+    current thread once the profiler is active are traced.
+    """
+    timer = attr.ib(type=t.Callable[[], float], default=time.perf_counter)
+    stats = attr.ib(type=t.Dict[Origin, OriginStats], factory=dict)
+    # [origins of its lines, origin of its current line, when the line started] of
+    # each generated function running, innermost last
+    _frames = attr.ib(init=False, repr=False, factory=list)
+    # when time was last attributed
+    _last = attr.ib(init=False, repr=False, default=0.0)
+    # the trace function in effect before, restored on exit
+    _previous = attr.ib(init=False, repr=False, default=None)
+
+    def __enter__(self) -> "LineProfiler":
+        self._previous = sys.gettrace()
+        self._last = self.timer()
+        sys.settrace(self._call)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        sys.settrace(self._previous)
+        self._frames.clear()
+
+    def _stats(self, where: Origin) -> OriginStats:
+        entry = self.stats.get(where)
+        if entry is None:
+            entry = self.stats[where] = OriginStats()
+        return entry
+
+    def _charge(self, now: float) -> None:
+        # time since the last event is spent in the innermost generated line
+        if self._frames:
+            where = self._frames[-1][1]
+            if where is not None:
+                self._stats(where).tottime += now - self._last
+        self._last = now
+
+    def _end_line(self, entry: t.List[t.Any], now: float) -> None:
+        if entry[1] is not None:
+            self._stats(entry[1]).cumtime += now - entry[2]
+
+    def _call(self, frame: types.FrameType, event: str, arg: t.Any) -> t.Any:
+        origins = _origins.get(frame.f_code.co_filename)
+        if origins is None:
+            return None
+        now = self.timer()
+        self._charge(now)
+        # a generator resumes in the line it yielded from
+        lineno = frame.f_lineno
+        self._frames.append([origins, origins[lineno - 1] if 0 < lineno <= len(origins) else None, now])
+        return self._trace
+
+    def _trace(self, frame: types.FrameType, event: str, arg: t.Any) -> t.Any:
+        if not self._frames:  # traced before the profiler exited
+            return None
+        if event == "line":
+            now = self.timer()
+            self._charge(now)
+            entry = self._frames[-1]
+            self._end_line(entry, now)
+            origins, lineno = entry[0], frame.f_lineno
+            where = entry[1] = origins[lineno - 1] if 0 < lineno <= len(origins) else None
+            entry[2] = now
+            if where is not None:
+                self._stats(where).calls += 1
+        elif event == "return":
+            now = self.timer()
+            self._charge(now)
+            self._end_line(self._frames.pop(), now)
+        return self._trace
@@ -1,10 +1,72 @@
 import attr
+import typing as t
 
 TokenType = str
 
 
-@attr.s(slots=True)
+@attr.s(slots=True, cmp=False, repr=False)
 class Token:
     type = attr.ib(type=TokenType)
-    literal = attr.ib(type=str, default="")
-    startpos = attr.ib(type=int, default=0, cmp=False)
+    _literal = attr.ib(type=str, default="")
+    startpos = attr.ib(type=int, default=0)
+
+    @property
+    def literal(self) -> str:
+        return self._literal
+
+    @literal.setter
+    def literal(self, literal: str) -> None:
+        self._literal = literal
+
+    # like attrs' cmp=True, but `startpos` is not compared and LazyTokens
+    # compare equal to the Token with the same type and literal.
+    def __eq__(self, other):
+        if not isinstance(other, Token):
+            return NotImplemented
+        return self.type == other.type and self.literal == other.literal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}(type={self.type!r}, literal={self.literal!r}, startpos={self.startpos!r})"
+
+
+@attr.s(slots=True)
+class TokenSource:
+    """
+    A lexer buffer which lazy tokens slice their literals from.
+
+    `base` is the input position of `buf[0]`, `encoding` is set if `buf` holds bytes.
+    """
+    buf = attr.ib(repr=False)
+    base = attr.ib(type=int)
+    encoding = attr.ib(type=t.Optional[str], default=None)
+
+    def slice(self, pos: int, n: int) -> str:
+        start = pos - self.base
+        literal = self.buf[start:start + n]
+        if self.encoding is not None:
+            return str(literal, self.encoding)
+        return literal
+
+
+@attr.s(slots=True, cmp=False, repr=False)
+class LazyToken(Token):
+    """
+    Token whose literal is only sliced (and decoded) from the source on first access.
+
+    Until then, `_literal` refers to the TokenSource (keeping its buffer alive)
+    and `_len` is the length of the literal within it.
+    """
+    _len = attr.ib(type=int, default=0, kw_only=True)
+
+    @property
+    def literal(self) -> str:
+        literal = self._literal
+        if type(literal) is not str:
+            literal = self._literal = literal.slice(self.startpos, self._len)
+        return literal
+
+    @literal.setter
+    def literal(self, literal: str) -> None:
+        self._literal = literal
@@ -0,0 +1,367 @@
+"""
+
+Compile moustache ASTs into Python render functions.
+
+The AST is translated into the source of a generator function, through a
+CodeEmitter, which yields the template's literal text as precomputed
+constants and the values of its tags, evaluated by the Python code their
+expressions compile to (see expr.py). Rendering
+a template is then a single call to that function, rather than another walk
+of the AST, and its output can be streamed chunk by chunk.
+
+Sections nested deeper than MAX_NESTING within one function (Python allows
+few statically nested blocks) are moved into functions of their own, which
+the enclosing function delegates to with `yield from`.
+
+Each generated line records its origin, the (name, offset) of the tag or text
+it was generated from, and the code is registered with the sourcemap, so that
+tracebacks show the generated lines and sourcemap.LineProfiler can attribute
+the time spent rendering to the tags of templates. Templates compiled without a
+name are named FILENAME.
+"""
+import attr
+import hashlib
+import typing as t
+from functools import lru_cache
+from io import StringIO
+from ghostwriter.lang import lexer, sourcemap
+from ghostwriter.lang.codecache import DiskCodeCache
+from ghostwriter.lang.codeemitter import CodeEmitter, compile_source
+from .expr import RUNTIME as EXPR_RUNTIME, expression_code
+from .lexer import MoustacheLexer
+from .parser import ASTNode, Node, Section, from_lists, parse_tree
+from .runtime import Partials
+
+RENDER_FN = "render_body"
+FILENAME = "<moustache>"
+# part of the keys of templates cached on disk, bump it whenever the
+# generated code (e.g. the render function's signature or the runtime helpers
+# it imports) or the entries stored change, so entries written by an older
+# build are never loaded
+CODEGEN_VERSION = "4"
+RUNTIME = (*EXPR_RUNTIME, "scopes", "to_str", "render_partial")
+# number of sections nested in one generated function, a section nested
+# deeper is compiled into a function of its own
+MAX_NESTING = 16
+
+# a mapping (or Loader) of partial names to Templates or template strings
+PartialSource = t.Any
+
+# render_body(stack, partials), yields the output
+RenderFn = t.Callable[[t.List[t.Any], Partials], t.Iterator[str]]
+
+# (name, sha256 of its text) of each partial inlined into a template
+Depends = t.Tuple[t.Tuple[str, str], ...]
+
+# the origin of each line of the generated source, see sourcemap
+Origins = t.Optional[t.List[t.Optional[sourcemap.Origin]]]
+
+
+@attr.s(slots=True, frozen=True)
+class Template:
+    # the generated Python source, for inspection
+    source = attr.ib(type=str, repr=False)
+    render_body = attr.ib(type=RenderFn, repr=False)
+    # the partials inlined at compile time, see Compiler.partials
+    depends = attr.ib(type=Depends, default=())
+
+    def render(self, ctx: t.Any = None, partials: t.Optional[PartialSource] = None) -> str:
+        """
+        Render the template with the values in `ctx`, a mapping or object.
+
+        `partials` maps the names of partials to Templates or template
+        strings, e.g. a dict or a Loader.
+        """
+        return "".join(self.render_body([] if ctx is None else [ctx], Partials(partials)))
+
+    def stream(self, ctx: t.Any = None, partials: t.Optional[PartialSource] = None) -> t.Iterator[str]:
+        """
+        Like render(), but yield the output in chunks as it is rendered.
+
+        Only the current chunk is held in memory, sections iterate over
+        their values lazily.
+        """
+        return self.render_body([] if ctx is None else [ctx], Partials(partials))
+
+    def render_to(self, fileobj: t.TextIO, ctx: t.Any = None,
+                  partials: t.Optional[PartialSource] = None) -> None:
+        """
+        Like render(), but write the output to the text file `fileobj` as it is rendered.
+        """
+        fileobj.writelines(self.render_body([] if ctx is None else [ctx], Partials(partials)))
+
+
+@attr.s(slots=True)
+class _Frame:
+    """
+    A section being compiled, see Compiler.body().
+    """
+    # the nodes of the section left to compile
+    nodes = attr.ib(type=t.Iterator[Node])
+    section = attr.ib(type=t.Optional[Section])
+    # number of lines of the function before the section's body
+    lines = attr.ib(type=int)
+    # (emitter, nesting, yields) of the enclosing function, if the section is a function of its own
+    enclosing = attr.ib(type=t.Optional[t.Tuple[CodeEmitter, int, bool]], default=None)
+    # adjacent text, appended as one chunk
+    text = attr.ib(type=t.List[str], factory=list)
+    text_origin = attr.ib(type=t.Optional[t.Tuple[str, int]], default=None)
+
+
+@attr.s(slots=True)
+class Compiler:
+    # the function being compiled
+    emitter = attr.ib(type=CodeEmitter, factory=CodeEmitter)
+    # number of sections compiled so far, to name their loop variables
+    sections = attr.ib(type=int, default=0)
+    # False until the function yields anything
+    yields = attr.ib(type=bool, default=False)
+    # number of sections the function is nested in so far
+    nesting = attr.ib(type=int, default=0)
+    # where the functions of deeply nested sections go, and their (signature, name, origin)
+    functions = attr.ib(type=t.Optional[CodeEmitter], default=None)
+    signatures = attr.ib(type=t.List[t.Tuple[CodeEmitter, str, t.Tuple[str, int]]], factory=list)
+    # if set, partials whose text is found here are inlined rather than
+    # looked up when rendering, see partial_text()
+    partials = attr.ib(type=t.Optional[PartialSource], default=None)
+    # names of the partials being inlined (and the template's own name),
+    # a partial including one of these is recursive and is not inlined
+    inlining = attr.ib(type=t.List[str], factory=list)
+    # the partials inlined so far, see Template.depends
+    inlined = attr.ib(type=t.Dict[str, str], factory=dict)
+    # names of the filters applied by the template's expressions
+    filters = attr.ib(type=t.Set[str], factory=set)
+
+    def compile(self, ast: ASTNode) -> CodeEmitter:
+        e = self.emitter
+        e.add_line(f"from ghostwriter.moustache.runtime import FILTERS, {', '.join(RUNTIME)}")
+        e.add_line("")
+        self.functions = e.add_section()
+        # the signature depends on the filters used, known once the body is compiled
+        self.signatures.append((e.add_section(), RENDER_FN, self.origin(0)))
+        e.indent()
+        # the nested list form of the AST is accepted as well
+        self.body(from_lists(ast))
+        if not self.yields:
+            # still a generator, if an empty one
+            e.add_line("yield from ()")
+        e.dedent()
+        # runtime helpers and filters are bound as defaults, making them fast local lookups
+        defaults = "".join(f", {name}={name}" for name in RUNTIME)
+        defaults += "".join(f", f_{name}=FILTERS[{name!r}]" for name in sorted(self.filters))
+        for signature, name, origin in self.signatures:
+            signature.add_line(f"def {name}(stack, partials{defaults}):", origin=origin)
+        return e
+
+    def origin(self, pos: int) -> t.Tuple[str, int]:
+        """
+        Return the origin of the node at `pos` in the template (or partial) being compiled.
+        """
+        return self.inlining[-1] if self.inlining else FILENAME, pos
+
+    def body(self, nodes: t.Iterable[Node]) -> None:
+        # sections are compiled with an explicit stack of those enclosing the
+        # current one, so they may be nested arbitrarily deep
+        frames = [_Frame(self.expand(nodes), None, len(self.emitter.code))]
+        while frames:
+            frame = frames[-1]
+            for node in frame.nodes:
+                typ = node.type
+                if typ == "TXT":
+                    # adjacent text (e.g. around comments) is appended as one chunk
+                    if not frame.text:
+                        frame.text_origin = self.origin(node.startpos)
+                    frame.text.append(node.literal)
+                    continue
+                self.text(frame.text, frame.text_origin)
+                frame.text = []
+                if typ == "SECTION":
+                    frames.append(self.open_section(node))
+                    break
+                elif typ == "EXPR":
+                    self.yields = True
+                    code, filters = expression_code(node.literal)
+                    self.filters.update(filters)
+                    self.emitter.add_line(f"yield to_str({code})", origin=self.origin(node.startpos))
+                elif typ == "PARTIAL":
+                    self.yields = True
+                    self.emitter.add_line(f"yield from render_partial(partials, {node.literal!r}, stack)",
+                                          origin=self.origin(node.startpos))
+                else:
+                    raise RuntimeError(f"cannot compile token of type '{typ}'")
+            else:
+                self.text(frame.text, frame.text_origin)
+                if len(self.emitter.code) == frame.lines:
+                    self.emitter.add_line("pass")
+                frames.pop()
+                if frame.section is not None:
+                    self.close_section(frame)
+
+    def expand(self, nodes: t.Iterable[Node]) -> t.Iterator[Node]:
+        """
+        Yield `nodes`, with (non-recursive) partials replaced by their contents.
+        """
+        for node in nodes:
+            if node.type != "PARTIAL" or node.literal in self.inlining:
+                yield node
+                continue
+            name = node.literal
+            text = partial_text(self.partials, name)
+            if text is None:  # resolved when rendering, if at all
+                yield node
+                continue
+            self.inlined[name] = _text_digest(text)
+            # sections within the partial are compiled while it is on the stack
+            self.inlining.append(name)
+            yield from self.expand(parse_template(text))
+            self.inlining.pop()
+
+    def text(self, chunks: t.List[str], origin: t.Optional[t.Tuple[str, int]] = None) -> None:
+        text = "".join(chunks)
+        if text:
+            self.yields = True
+            self.emitter.add_line(f"yield {text!r}", origin=origin)
+
+    def open_section(self, section: Section) -> _Frame:
+        """
+        Emit the start of the loop over the scopes of `section`, return the frame to compile its body in.
+        """
+        self.sections += 1
+        origin = self.origin(section.startpos)
+        enclosing = None
+        if self.nesting == MAX_NESTING:
+            name = f"section{self.sections}"
+            self.yields = True
+            self.emitter.add_line(f"yield from {name}(stack, partials)", origin=origin)
+            enclosing = (self.emitter, self.nesting, self.yields)
+            self.emitter = self.functions.add_section()
+            self.signatures.append((self.emitter.add_section(), name, origin))
+            self.emitter.indent()
+            self.nesting = 0
+            self.yields = False
+        e = self.emitter
+        scope = f"scope{self.sections}"
+        e.add_line(f"for {scope} in scopes(lookup(stack, {section.literal!r})):", origin=origin)
+        e.indent()
+        e.add_line(f"stack.append({scope})", origin=origin)
+        self.nesting += 1
+        return _Frame(self.expand(section.children), section, len(e.code), enclosing)
+
+    def close_section(self, frame: _Frame) -> None:
+        e = self.emitter
+        e.add_line("stack.pop()", origin=self.origin(frame.section.startpos))
+        e.dedent()
+        self.nesting -= 1
+        if frame.enclosing is not None:
+            if not self.yields:
+                e.add_line("yield from ()")
+            e.dedent()
+            e.add_line("")
+            self.emitter, self.nesting, self.yields = frame.enclosing
+
+def partial_text(partials: t.Optional[PartialSource], name: str) -> t.Optional[str]:
+    """
+    Return the template text of partial `name`, None if it is unknown or only available compiled.
+    """
+    if partials is None:
+        return None
+    if hasattr(partials, "get_text"):  # a Loader
+        return partials.get_text(name)
+    text = partials.get(name)
+    return text if isinstance(text, str) else None
+
+
+@lru_cache(maxsize=256)
+def parse_template(template: str, seq_open: str = "{{", seq_close: str = "}}") -> t.List[Node]:
+    m = MoustacheLexer(lexer.Lexer(StringIO(template)), seq_open=seq_open, seq_close=seq_close)
+    return parse_tree(m.start())
+
+
+def generate(ast: ASTNode) -> str:
+    """
+    Return the Python source of the render function for `ast`.
+    """
+    return str(Compiler().compile(ast))
+
+
+def _template(source: str, code: t.Any, origins: Origins, depends: Depends = ()) -> Template:
+    # code is compiled under the source's pseudo-filename, see compile_source()
+    sourcemap.register(code.co_filename, source, origins, code)
+    env: t.Dict[str, t.Any] = {}
+    exec(code, env)
+    return Template(source=source, render_body=env[RENDER_FN], depends=depends)
+
+
+def compile_ast(ast: ASTNode) -> Template:
+    e = Compiler().compile(ast)
+    source = str(e)
+    return _template(source, compile_source(source), e.source_map())
+
+
+def compile_template(template: str, seq_open: str = "{{", seq_close: str = "}}",
+                     cache: t.Optional[DiskCodeCache] = None,
+                     partials: t.Optional[PartialSource] = None, name: t.Optional[str] = None) -> Template:
+    """
+    Lex, parse and compile `template`. Compiled templates are cached.
+
+    If a DiskCodeCache is given, the generated code is also cached on disk
+    where other processes can load it from rather than compiling again.
+
+    If `partials` is given, the partials found in it (as template text) are
+    inlined, except for recursive ones. `name` is the template's own name
+    among the partials, if any. Such templates are not cached in memory, as
+    the partials may change, which Template.depends records.
+
+    `name` is also the name the source map gives as the origin of the
+    generated lines, see sourcemap.
+    """
+    if partials is None:
+        return _compile_cached(template, seq_open, seq_close, cache, name)
+
+    if cache is not None:
+        key = cache.key("moustache", CODEGEN_VERSION, template, seq_open, seq_close, "inline", name or "")
+        cached = cache.load(key)
+        if cached is not None:
+            source, code, origins, depends = cached
+            if all(_text_digest(partial_text(partials, dep)) == digest for dep, digest in depends):
+                return _template(source, code, origins, depends)
+
+    compiler = Compiler(partials=partials, inlining=[name] if name else [])
+    e = compiler.compile(parse_template(template, seq_open, seq_close))
+    source = str(e)
+    code = compile_source(source)
+    origins = e.source_map()
+    depends = tuple(sorted(compiler.inlined.items()))
+    if cache is not None:
+        cache.store(key, (source, code, origins, depends))
+    return _template(source, code, origins, depends)
+
+
+def clear_caches() -> None:
+    """
+    Forget the templates parsed and compiled so far.
+    """
+    parse_template.cache_clear()
+    _compile_cached.cache_clear()
+
+
+def _text_digest(text: t.Optional[str]) -> t.Optional[str]:
+    return None if text is None else hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=256)
+def _compile_cached(template: str, seq_open: str, seq_close: str,
+                    cache: t.Optional[DiskCodeCache], name: t.Optional[str] = None) -> Template:
+    if cache is not None:
+        key = cache.key("moustache", CODEGEN_VERSION, template, seq_open, seq_close, name or "")
+        cached = cache.load(key)
+        if cached is not None:
+            return _template(*cached)
+
+    e = Compiler(inlining=[name] if name else []).compile(parse_template(template, seq_open, seq_close))
+    source = str(e)
+    code = compile_source(source)
+    origins = e.source_map()
+    if cache is not None:
+        cache.store(key, (source, code, origins))
+    return _template(source, code, origins)
@@ -0,0 +1,250 @@
+"""
+
+Expressions in EXPR tags, e.g. `{{ user.name | default("anonymous") }}`.
+
+An expression is a name looked up in the context, followed by any number of
+attribute accesses (`a.b`, `a.0`), indexing (`a[b]`, `a["b"]`) and filters
+(`a | upper`, `a | join(", ")`), optionally compared (`==`, `!=`, `<`, `<=`,
+`>`, `>=`) with another such expression or a literal number or string.
+Ordering comparisons are false if either side is None.
+
+Expressions are parsed by a Pratt Parser whose parse functions build the
+Python code of the expression rather than an AST, which the compiler inlines
+into a template's render function (see compiler.py). An expression is thus
+parsed once per source text and evaluated by plain Python code, with no
+interpretation left when rendering. Missing names, attributes and items
+evaluate to None rather than raising.
+"""
+import typing as t
+from functools import lru_cache
+from io import StringIO
+from ghostwriter.lang import lexer
+from ghostwriter.lang.charclass import CharClass
+from ghostwriter.lang.token import Token
+from . import runtime
+from .parser import Grammar, ParseError, Parser
+
+ALPHABET_EN = "AaBbCcDdEeFfGgHhIiJjKkLlMmNnOoPpQqRrSsTtUuVvWwXxYyZz"
+DIGITS = "0123456789"
+
+CC_WHITESPACE = CharClass(" \t\r\n")
+CC_NAME_START = CharClass(ALPHABET_EN + "_")
+CC_NAME = CharClass(ALPHABET_EN + "_" + DIGITS)
+CC_DIGITS = CharClass(DIGITS)
+
+# operators, longest first
+OPERATORS = (
+    ("==", "EQ"), ("!=", "NE"), ("<=", "LE"), (">=", "GE"), ("<", "LT"), (">", "GT"),
+    (".", "DOT"), ("[", "LBRACKET"), ("]", "RBRACKET"), ("(", "LPAREN"), (")", "RPAREN"),
+    ("|", "PIPE"), (",", "COMMA"),
+)
+
+PRECEDENCE_COMPARE = 1
+PRECEDENCE_FILTER = 2
+PRECEDENCE_ACCESS = 3
+
+# runtime helpers the generated code calls, besides the filters
+RUNTIME = ("lookup", "get_attr", "get_item", "lt", "le", "gt", "ge")
+
+# the runtime helpers of the ordering comparisons, which tolerate None
+ORDERING = {"<": "lt", "<=": "le", ">": "gt", ">=": "ge"}
+
+# (the Python code of an expression, names of the filters it applies)
+ExpressionCode = t.Tuple[str, t.FrozenSet[str]]
+
+
+class ExpressionError(ParseError):
+    __attrs__ = ['message', 'expression']
+
+    def __init__(self, expression: str, message: str):
+        self.expression = expression
+        self.message = message
+        super().__init__(message)
+
+
+class ExprLexer:
+    """
+    Lex an expression into NAME, NUMBER, STRING and operator tokens.
+    """
+    __slots__ = ("lexer",)
+
+    def __init__(self, source: str):
+        self.lexer = lexer.Lexer(StringIO(source), track_lines=False)
+
+    def start(self) -> t.Iterator[Token]:
+        lex = self.lexer
+        prev = None
+        while True:
+            lex.skip_while(CC_WHITESPACE)
+            lex.ignore()
+            c = lex.peek(1)
+            if c == "":
+                return
+            if c in CC_NAME_START:
+                lex.skip_while(CC_NAME)
+                typ = "NAME"
+            elif c in CC_DIGITS:
+                lex.skip_while(CC_DIGITS)
+                # the fraction of a number, unless it is an index in a path (`a.0.1`)
+                if prev != "DOT":
+                    if lex.peek(2)[:1] == "." and lex.peek(2)[1:] in CC_DIGITS:
+                        lex.next(1)
+                        lex.skip_while(CC_DIGITS)
+                    if lex.peek(1) == ".":  # e.g. `1.2.3`
+                        raise lexer.LexerError(lex, f"malformed number '{lex.current()}.'")
+                typ = "NUMBER"
+            elif c in "\"'":
+                lex.next(1)
+                lex.ignore()
+                lex.skip_until_seq(c)
+                if lex.peek(1) != c:
+                    raise lexer.LexerError(lex, "unterminated string")
+                prev = "STRING"
+                yield lex.emit("STRING")
+                lex.next(1)
+                lex.ignore()
+                continue
+            else:
+                for op, typ in OPERATORS:
+                    if lex.peek(len(op)) == op:
+                        lex.next(len(op))
+                        break
+                else:
+                    raise lexer.LexerError(lex, f"unexpected character '{c}'")
+            prev = typ
+            yield lex.emit(typ)
+
+
+def _error(p: Parser, message: str) -> None:
+    p.errors.append(ExpressionError(p.ctx["source"], message))
+
+
+def parse_name(p: Parser) -> str:
+    return f"lookup(stack, {p.curr_token.literal!r})"
+
+
+def parse_number(p: Parser) -> str:
+    literal = p.curr_token.literal
+    return repr(float(literal) if "." in literal else int(literal))
+
+
+def parse_string(p: Parser) -> str:
+    return repr(p.curr_token.literal)
+
+
+def parse_group(p: Parser) -> t.Optional[str]:
+    p.advance()
+    inner = p.parse_expression()
+    if not p.expect_peek("RPAREN"):
+        return None
+    return f"({inner})"
+
+
+def parse_attr(p: Parser, left: str) -> t.Optional[str]:
+    if p.peek_token_is("NUMBER"):  # `a.0`, an index
+        p.advance()
+        return f"get_item({left}, {parse_number(p)})"
+    if not p.expect_peek("NAME"):
+        return None
+    return f"get_attr({left}, {p.curr_token.literal!r})"
+
+
+def parse_index(p: Parser, left: str) -> t.Optional[str]:
+    p.advance()
+    inner = p.parse_expression()
+    if not p.expect_peek("RBRACKET"):
+        return None
+    return f"get_item({left}, {inner})"
+
+
+def parse_filter(p: Parser, left: str) -> t.Optional[str]:
+    if not p.expect_peek("NAME"):
+        return None
+    name = p.curr_token.literal
+    if name not in runtime.FILTERS:
+        _error(p, f"unknown filter '{name}'")
+        return None
+    p.ctx["filters"].add(name)
+    args = [left]
+    if p.peek_token_is("LPAREN"):
+        p.advance()
+        while not p.peek_token_is("RPAREN"):
+            p.advance()
+            arg = p.parse_expression()
+            if arg is None or p.errors:
+                return None
+            args.append(arg)
+            if not p.peek_token_is("COMMA"):
+                break
+            p.advance()
+        if not p.expect_peek("RPAREN"):
+            return None
+    return f"f_{name}({', '.join(args)})"
+
+
+def parse_compare(p: Parser, left: str) -> str:
+    op = p.curr_token.literal
+    precedence = p.curr_precedence()
+    p.advance()
+    right = p.parse_expression(precedence)
+    if op in ORDERING:
+        return f"{ORDERING[op]}({left}, {right})"
+    return f"({left} {op} {right})"
+
+
+GRAMMAR = Grammar(
+    prefix_parse_fns={
+        "NAME": parse_name,
+        "NUMBER": parse_number,
+        "STRING": parse_string,
+        "LPAREN": parse_group,
+    },
+    infix_parse_fns={
+        "DOT": parse_attr,
+        "LBRACKET": parse_index,
+        "PIPE": parse_filter,
+        **{typ: parse_compare for typ in ("EQ", "NE", "LT", "LE", "GT", "GE")},
+    },
+    precedences={
+        "DOT": PRECEDENCE_ACCESS,
+        "LBRACKET": PRECEDENCE_ACCESS,
+        "PIPE": PRECEDENCE_FILTER,
+        **{typ: PRECEDENCE_COMPARE for typ in ("EQ", "NE", "LT", "LE", "GT", "GE")},
+    })
+
+
+@lru_cache(maxsize=1024)
+def expression_code(source: str) -> ExpressionCode:
+    """
+    Return the Python code evaluating expression `source`, and the filters it applies.
+
+    The code refers to the context as `stack`, the runtime helpers by
+    their names and filter `name` as `f_name`. Raises ExpressionError if
+    `source` is not a valid expression.
+    """
+    if not source.strip():
+        return "None", frozenset()
+    try:
+        p = Parser(ExprLexer(source).start(), GRAMMAR, ctx={"source": source, "filters": set()})
+        code = p.parse_expression()
+        if not p.errors and not p.peek_token_is("EOF"):
+            _error(p, f"unexpected '{p.peek_token.literal}'")
+    except lexer.LexerError as e:
+        raise ExpressionError(source, f"{e.message} at {e.pos}") from None
+    if p.errors:
+        error = p.errors[0]
+        raise ExpressionError(source, f"invalid expression '{source}': {error.message}")
+    return code, frozenset(p.ctx["filters"])
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(source: str) -> t.Callable[[runtime.Stack], t.Any]:
+    """
+    Return a function evaluating expression `source` in the scopes of a stack.
+    """
+    code, filters = expression_code(source)
+    params = "".join(f", {name}={name}" for name in RUNTIME)
+    params += "".join(f", f_{name}=FILTERS[{name!r}]" for name in sorted(filters))
+    env = {name: getattr(runtime, name) for name in RUNTIME}
+    env["FILTERS"] = runtime.FILTERS
+    return eval(f"lambda stack{params}: {code}", env)
@@ -0,0 +1,349 @@
+"""
+
+Re-lex and re-parse a template incrementally as it is edited.
+
+A Document keeps the tokens and AST of its text, along with a checkpoint of
+the lexer's state (position and delimiters in effect) after every tag.
+Since a tag ends with its close sequence, the state at such a checkpoint
+depends only on the text before it. An edit is re-lexed from the last
+checkpoint before it, until the new tokens are back in step with the old
+ones: the lexer reaches a checkpoint past the edit which was also a
+checkpoint (with the same delimiters) before the edit. Everything from
+there on is reused, the AST likewise re-parses only the top-level nodes
+spanning the re-lexed tokens.
+
+Checkpoints and top-level nodes are located by binary search on the start
+positions of their tokens.
+
+The reused tokens are not rewritten to move them by the size of the edit:
+a Document's tokens store their positions relative to a _Shift shared by a
+run of up to BLOCK_SIZE consecutive tokens, and an edit moves the tokens
+after it by updating their shifts. Sections take their positions from
+their open tags. Only the runs either side of an edit are split or merged,
+so an edit costs in proportion to its size plus BLOCK_SIZE, and to the
+number of shifts after it; the text and lists are spliced by plain copies.
+"""
+import attr
+import typing as t
+from ghostwriter.lang import lexer
+from ghostwriter.lang.token import Token
+from .lexer import MoustacheLexer
+from .parser import Node, Section, parse_nodes
+
+# the most tokens sharing a shift: an edit moves the later tokens by
+# updating their shifts, about (number of tokens / BLOCK_SIZE) of them
+BLOCK_SIZE = 512
+
+# (the tag token, distance from its start to the end of the tag, seq_open, seq_close)
+Checkpoint = t.Tuple[Token, int, str, str]
+
+
+def _cp_pos(cp: Checkpoint) -> int:
+    return cp[0].startpos + cp[1]
+
+
+def _bisect(items: t.Sequence[t.Any], pos: int, key: t.Callable[[t.Any], int], lo: int = 0) -> int:
+    """
+    Return the number of `items` (sorted by `key`) whose key is at most `pos`, searching from `lo` on.
+    """
+    hi = len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(items[mid]) <= pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _startpos(tok: Node) -> int:
+    return tok.startpos
+
+
+@attr.s(slots=True)
+class _TextReader:
+    """
+    Stream reading a string from position `pos` on, without copying the rest of it first.
+    """
+    text = attr.ib(type=str)
+    pos = attr.ib(type=int, default=0)
+
+    def read(self, size: int = -1) -> str:
+        start = self.pos
+        self.pos = len(self.text) if size < 0 else min(start + size, len(self.text))
+        return self.text[start:self.pos]
+
+    def close(self) -> None:
+        pass
+
+
+@attr.s(slots=True, eq=False)
+class _Shift:
+    # added to the stored positions of the tokens sharing it
+    delta = attr.ib(type=int, default=0)
+    # the number of tokens sharing it, a run of consecutive ones
+    size = attr.ib(type=int, default=0)
+
+
+# the slot of Token.startpos, which _Token stores its position relative to its shift in
+_STORED_POS = Token.startpos
+
+
+class _Token(Token):
+    """
+    A token of a Document, its position stored relative to its `shift`.
+    """
+    __slots__ = ("shift",)
+
+    @property
+    def startpos(self) -> int:
+        return _STORED_POS.__get__(self) + self.shift.delta
+
+    @startpos.setter
+    def startpos(self, pos: int) -> None:
+        _STORED_POS.__set__(self, pos - self.shift.delta)
+
+
+def _token(tok: Token, shift: _Shift) -> _Token:
+    new = _Token.__new__(_Token)
+    new.type = tok.type
+    new.literal = tok.literal
+    new.shift = shift
+    new.startpos = tok.startpos
+    return new
+
+
+def _reshift(tokens: t.Sequence[_Token], shift: _Shift) -> None:
+    """
+    Position `tokens` relative to `shift` instead, without moving them.
+    """
+    get, put = _STORED_POS.__get__, _STORED_POS.__set__
+    for tok in tokens:
+        put(tok, get(tok) + tok.shift.delta - shift.delta)
+        tok.shift = shift
+
+
+def _blocks(tokens: t.List[_Token]) -> t.List[_Shift]:
+    """
+    Give each BLOCK_SIZE of `tokens`, which share a shift, a shift of their own.
+    """
+    shifts = []
+    for i in range(0, len(tokens), BLOCK_SIZE):
+        block = tokens[i:i + BLOCK_SIZE]
+        shift = _Shift(block[0].shift.delta, len(block))
+        for tok in block:
+            tok.shift = shift
+        shifts.append(shift)
+    return shifts
+
+
+class _Section(Section):
+    """
+    A section of a Document, at the position of its open tag.
+    """
+    __slots__ = ("open_tag",)
+
+    @property
+    def startpos(self) -> int:
+        return self.open_tag.startpos
+
+
+def _section(open_tag: Token, children: t.List[Node]) -> _Section:
+    section = _Section.__new__(_Section)
+    section.type = "SECTION"
+    section.literal = open_tag.literal
+    section.children = tuple(children)
+    section.open_tag = open_tag
+    return section
+
+
+@attr.s(slots=True)
+class Document:
+    text = attr.ib(type=str)
+    seq_open = attr.ib(type=str, default="{{")
+    seq_close = attr.ib(type=str, default="}}")
+
+    tokens = attr.ib(init=False, repr=False, type=t.List[Token])
+    ast = attr.ib(init=False, repr=False, type=t.List[Node])
+    # lexer states to restart from, after each tag
+    checkpoints = attr.ib(init=False, repr=False, type=t.List[Checkpoint])
+    # the shifts of the tokens, in order
+    _shifts = attr.ib(init=False, repr=False, type=t.List[_Shift])
+
+    def __attrs_post_init__(self):
+        self.tokens, self.checkpoints = self._lex(self.text, 0, self.seq_open, self.seq_close, _Shift())
+        self._shifts = _blocks(self.tokens)
+        self.ast = [node for node, _ in parse_nodes(iter(self.tokens), _section)]
+
+    def _lex(self, text: str, base: int, seq_open: str, seq_close: str, shift: _Shift,
+             resync: t.Optional[t.Callable[[int, str, str], bool]] = None
+             ) -> t.Tuple[t.List[Token], t.List[Checkpoint]]:
+        """
+        Lex `text` from position `base` on, until the end or `resync` returns True for a checkpoint.
+
+        The tokens are positioned relative to `shift`.
+        """
+        m = MoustacheLexer(lexer.Lexer(_TextReader(text, base), track_lines=False), seq_open=seq_open, seq_close=seq_close)
+        tokens: t.List[Token] = []
+        checkpoints: t.List[Checkpoint] = []
+        try:
+            for tok in m.start():
+                tok.startpos += base
+                tok = _token(tok, shift)
+                tokens.append(tok)
+                if tok.type == "TXT":  # its end depends on the text after it
+                    continue
+                pos = base + m.lexer.pos
+                checkpoints.append((tok, pos - tok.startpos, m.seq_open, m.seq_close))
+                if resync is not None and resync(pos, m.seq_open, m.seq_close):
+                    break
+        except lexer.LexerError as e:
+            e.pos += base
+            raise
+        return tokens, checkpoints
+
+    def edit(self, offset: int, removed: int, inserted: str) -> None:
+        """
+        Replace the `removed` characters at `offset` by `inserted`, updating the tokens and AST.
+
+        If the new text fails to lex or parse, the error is raised and the document is left unchanged.
+        """
+        text = self.text[:offset] + inserted + self.text[offset + removed:]
+        delta = len(inserted) - removed
+        edit_end = offset + len(inserted)
+        old_cps = self.checkpoints
+
+        # re-lex from the last checkpoint at or before the edit
+        first = _bisect(old_cps, offset, _cp_pos)
+        if first:
+            _, _, seq_open, seq_close = old_cps[first - 1]
+            start = _cp_pos(old_cps[first - 1])
+        else:
+            start, seq_open, seq_close = 0, self.seq_open, self.seq_close
+        resynced_at = None
+
+        def resync(pos: int, seq_open: str, seq_close: str) -> bool:
+            nonlocal resynced_at
+            if pos < edit_end:
+                return False
+            i = _bisect(old_cps, pos - delta, _cp_pos)
+            if i and _cp_pos(old_cps[i - 1]) == pos - delta and old_cps[i - 1][2:] == (seq_open, seq_close):
+                resynced_at = i
+                return True
+            return False
+
+        relexed, checkpoints = self._lex(text, start, seq_open, seq_close, _Shift(), resync)
+
+        # the tokens before the restart are kept as they are, those after
+        # the resync are reused, moved by the size of the edit
+        tokens = self.tokens
+        head = _bisect(tokens, start - 1, _startpos)
+        if resynced_at is not None:
+            old_tail_pos = _cp_pos(old_cps[resynced_at - 1])
+            tail = _bisect(tokens, old_tail_pos - 1, _startpos)
+        else:
+            old_tail_pos = len(self.text) + 1
+            tail, resynced_at = len(tokens), len(old_cps)
+        tail_nodes = _bisect(self.ast, old_tail_pos - 1, _startpos)
+
+        # splice the re-lexed tokens in, with shifts of their own, and move
+        # the reused ones (and so the sections they open) by their shifts
+        self._split(tail)
+        shifts = self._shifts
+        moved = shifts.index(tokens[tail].shift) if tail < len(tokens) else len(shifts)
+        first_shift = shifts.index(tokens[head].shift) if head < tail else moved
+        replaced = tokens[head:tail]
+        for tok in replaced:
+            tok.shift.size -= 1
+        old_shifts = shifts[first_shift:moved]
+        new_shifts = [shift for shift in old_shifts if shift.size] + _blocks(relexed)
+        shifts[first_shift:moved] = new_shifts
+        moved_shifts = shifts[first_shift + len(new_shifts):]
+        for shift in moved_shifts:
+            shift.delta += delta
+        tokens[head:tail] = relexed
+        try:
+            first_node, last_node, nodes = self._reparse(head, head + len(relexed), tail_nodes)
+        except Exception:
+            tokens[head:head + len(relexed)] = replaced
+            for shift in moved_shifts:
+                shift.delta -= delta
+            shifts[first_shift:first_shift + len(new_shifts)] = old_shifts
+            for tok in replaced:
+                tok.shift.size += 1
+            self._merge(tail)
+            raise
+        self.text = text
+        self.checkpoints[first:resynced_at] = checkpoints
+        self.ast[first_node:last_node] = nodes
+
+        # merge the runs of tokens changed by the edit with their neighbours where they fit in a block
+        left = head - tokens[head - 1].shift.size if head else 0
+        after = head + len(relexed)
+        right = after + tokens[after].shift.size if after < len(tokens) else after
+        for seam in (right, after, head, left):
+            self._merge(seam)
+
+    def _split(self, index: int) -> None:
+        """
+        Give the tokens from `index` on a shift other than those before them.
+        """
+        tokens = self.tokens
+        if not 0 < index < len(tokens) or tokens[index - 1].shift is not tokens[index].shift:
+            return
+        shift = tokens[index].shift
+        end = index + 1
+        while end < len(tokens) and tokens[end].shift is shift:
+            end += 1
+        new = _Shift(shift.delta, end - index)
+        for tok in tokens[index:end]:
+            tok.shift = new
+        shift.size -= new.size
+        self._shifts.insert(self._shifts.index(shift) + 1, new)
+
+    def _merge(self, seam: int) -> None:
+        """
+        Let the runs of tokens either side of `seam` share a shift, if they fit in a block together.
+        """
+        tokens = self.tokens
+        if not 0 < seam < len(tokens):
+            return
+        left, right = tokens[seam - 1].shift, tokens[seam].shift
+        if left is right or left.size + right.size > BLOCK_SIZE:
+            return
+        if left.size < right.size:
+            run, old, new = tokens[seam - left.size:seam], left, right
+        else:
+            run, old, new = tokens[seam:seam + right.size], right, left
+        _reshift(run, new)
+        new.size += old.size
+        self._shifts.remove(old)
+
+    def _reparse(self, head: int, tail: int, tail_nodes: int) -> t.Tuple[int, int, t.List[Node]]:
+        """
+        Re-parse the top-level nodes spanning the re-lexed tokens[head:tail], the rest are reused.
+
+        The old AST's nodes from `tail_nodes` on are made of the reused
+        tokens after `tail`, both already moved to their new positions.
+        Return the old AST's nodes to replace, as a range, and the new ones.
+        """
+        tokens, old_ast = self.tokens, self.ast
+        # the top-level node containing the last token kept before the re-lexed ones
+        first_node = 0
+        if head:
+            first_node = max(_bisect(old_ast, tokens[head - 1].startpos, _startpos) - 1, 0)
+        index = _bisect(tokens, old_ast[first_node].startpos - 1, _startpos) if first_node else 0
+
+        nodes = []
+        last_node = len(old_ast)
+        for node, span in parse_nodes((tokens[i] for i in range(index, len(tokens))), _section):
+            nodes.append(node)
+            index += span
+            if index >= tail and index < len(tokens):
+                # back in step if the next token (a reused one) starts an old top-level node
+                pos = tokens[index].startpos
+                i = _bisect(old_ast, pos, _startpos, tail_nodes)
+                if i > tail_nodes and old_ast[i - 1].startpos == pos:
+                    last_node = i - 1
+                    break
+        return first_node, last_node, nodes
@@ -1,10 +1,17 @@
 import attr
 import typing as t
 from ghostwriter.lang import lexer
+from ghostwriter.lang.aio import AsyncByteSource, Feed, tokens_async
+from ghostwriter.lang.charclass import CharClass
 from ghostwriter.lang.token import Token
 
 ALPHABET_EN = "AaBbCcDdEeFfGgHhIiJjKkLlMmNnOoPpQqRrSsTtUuVvWwXxYyZz"
 
+# compiled once, used for every tag
+CC_WHITESPACE = CharClass(" \t")
+CC_IDENT_START = CharClass(ALPHABET_EN)
+CC_IDENT = CharClass(ALPHABET_EN + "_0123456789")
+
 
 @attr.s()
 class MoustacheLexer:
@@ -12,24 +19,52 @@ class MoustacheLexer:
     seq_open = attr.ib(type=str, default="{{")
     seq_close = attr.ib(type=str, default="}}")
 
+    def checkpoint(self) -> t.Tuple[t.Any, str, str]:
+        """
+        Save the state to restore() to, call between tokens only.
+        """
+        return self.lexer.save(), self.seq_open, self.seq_close
+
+    def restore(self, checkpoint: t.Tuple[t.Any, str, str]) -> None:
+        state, self.seq_open, self.seq_close = checkpoint
+        self.lexer.restore(state)
+
     def lex_ident(self, typ) -> None:
         lex = self.lexer
 
-        lex.next_while(" \t")
-        lex.next_while(ALPHABET_EN)
-        lex.next_while(ALPHABET_EN + "_0123456789")
-        lex.next_while(" \t")
+        # skip whitespace around the name rather than stripping the literal,
+        # which would force lazy tokens to build it.
+        lex.skip_while(CC_WHITESPACE)
+        lex.ignore()
+        lex.skip_while(CC_IDENT_START)
+        lex.skip_while(CC_IDENT)
+        tok = lex.emit(typ)
+        lex.skip_while(CC_WHITESPACE)
 
-        if lex.peek(2) != self.seq_close:
+        if lex.peek(len(self.seq_close)) != self.seq_close:
             raise lexer.LexerError(lex, "not a valid close tag, did not find close seq")
 
-        # remove whitespace from token name literal...
-        tok = lex.emit(typ)
-        tok.literal = tok.literal.strip()
+        lex.next(len(self.seq_close))
+        lex.ignore()
         yield (tok)
 
+    def lex_expr(self) -> None:
+        """
+        Lex an EXPR tag, whose contents (an expression, see expr.py) run up to the close seq.
+        """
+        lex = self.lexer
+        lex.skip_while(CC_WHITESPACE)
+        lex.ignore()
+        lex.skip_until_seq(self.seq_close)
+        if lex.peek(len(self.seq_close)) != self.seq_close:
+            raise lexer.LexerError(lex, "not a valid close tag, did not find close seq")
+        contents = lex.current()
+        lex.rewind(len(contents) - len(contents.rstrip(" \t")))
+        tok = lex.emit("EXPR")
+        lex.skip_while(CC_WHITESPACE)
         lex.next(len(self.seq_close))
         lex.ignore()
+        yield (tok)
 
     def delimiter_set(self) -> None:
         lex = self.lexer
@@ -44,15 +79,15 @@ class MoustacheLexer:
 
     def comment(self) -> None:
         lex = self.lexer
-        lex.next_until_seq(self.seq_close)
+        lex.skip_until_seq(self.seq_close)
         lex.expect_next(self.seq_close)
         lex.ignore()
 
     def start(self) -> t.Generator[Token, None, None]:
         lex = self.lexer
         while True:
-            lex.next_until_seq(self.seq_open)
-            if lex.current() != "":
+            lex.skip_until_seq(self.seq_open)
+            if lex.buf_cursor != lex.buf_start:  # rather than slicing (and decoding) the text
                 yield lex.emit("TXT")
             if lex.eof:
                 break
@@ -78,4 +113,17 @@ class MoustacheLexer:
             else:
                 lex.rewind(1)
                 lex.ignore()
-                yield from self.lex_ident("EXPR")
+                yield from self.lex_expr()
+
+
+def lex_async(source: AsyncByteSource, **kwargs) -> t.AsyncIterator[Token]:
+    """
+    Lex the template read from an async byte source, e.g. an asyncio.StreamReader.
+
+    Yields the same tokens as MoustacheLexer.start() would for the whole
+    input, without blocking the event loop. Keyword arguments are passed on
+    to MoustacheLexer (seq_open, seq_close) or the Lexer.
+    """
+    delims = {k: kwargs.pop(k) for k in ("seq_open", "seq_close") if k in kwargs}
+    m = MoustacheLexer(lexer.Lexer(Feed(source), **kwargs), **delims)
+    return tokens_async(m, m.lexer.stream)
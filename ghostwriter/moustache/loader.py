@@ -0,0 +1,138 @@
+"""
+
+Resolve partials (and templates) by name from files on a search path.
+
+Compiled templates are kept in a bounded LRU cache. Each lookup stats the
+file to catch modifications (by mtime and size); with `check_hash` the
+contents of modified files are hashed as well, so that touching a file
+without changing it does not recompile it. Within a single render, partials
+are only looked up once however often they are used, see runtime.Partials.
+
+Partials are inlined into the templates including them (unless `inline` is
+False), so a template is also recompiled when any partial inlined into it
+changes.
+"""
+import attr
+import hashlib
+import os
+import typing as t
+from collections import OrderedDict
+from ghostwriter.lang.codecache import DiskCodeCache
+from .compiler import Template, compile_template
+
+
+class TemplateNotFound(LookupError):
+    pass
+
+
+@attr.s(slots=True)
+class _Entry:
+    path = attr.ib(type=str)
+    # (st_mtime_ns, st_size) of the file the template was compiled from
+    stat = attr.ib(type=t.Tuple[int, int])
+    digest = attr.ib(type=t.Optional[bytes])
+    template = attr.ib(type=Template)
+    # (path, stat) of each partial inlined into the template
+    deps = attr.ib(type=t.Tuple[t.Tuple[str, t.Tuple[int, int]], ...], default=())
+
+    def deps_unchanged(self) -> bool:
+        return all(_stat(path) == stat for path, stat in self.deps)
+
+
+def _stat(path: str) -> t.Optional[t.Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@attr.s(slots=True)
+class Loader:
+    search_path = attr.ib(type=t.List[str], converter=lambda paths: [os.fspath(p) for p in paths])
+    suffixes = attr.ib(type=t.Tuple[str, ...], default=(".moustache", ""), kw_only=True)
+    encoding = attr.ib(type=str, default="utf-8", kw_only=True)
+    # number of compiled templates to keep
+    maxsize = attr.ib(type=int, default=128, kw_only=True)
+    check_hash = attr.ib(type=bool, default=False, kw_only=True)
+    cache = attr.ib(type=t.Optional[DiskCodeCache], default=None, kw_only=True)
+    inline = attr.ib(type=bool, default=True, kw_only=True)
+
+    entries = attr.ib(init=False, repr=False, factory=OrderedDict)
+    # name: (path, stat) of the templates read by get_text() while compiling
+    reads = attr.ib(init=False, repr=False, factory=dict)
+
+    def find(self, name: str) -> t.Optional[str]:
+        """
+        Return the path of the first file on the search path for template `name`, if any.
+        """
+        if not name or "/" in name or os.sep in name or name.startswith("."):
+            return None
+        for directory in self.search_path:
+            for suffix in self.suffixes:
+                path = os.path.join(directory, name + suffix)
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def get(self, name: str) -> t.Optional[Template]:
+        """
+        Return the compiled template `name`, None if it is not found.
+        """
+        entry = self.entries.get(name)
+        deps_unchanged = False
+        if entry is not None:
+            stat = _stat(entry.path)
+            deps_unchanged = entry.deps_unchanged()
+            if stat == entry.stat and deps_unchanged:
+                self.entries.move_to_end(name)
+                return entry.template
+            if stat is None:  # removed, maybe found elsewhere now
+                del self.entries[name]
+                entry = None
+
+        path = entry.path if entry is not None else self.find(name)
+        if path is None:
+            return None
+        stat = _stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).digest() if self.check_hash else None
+        if entry is not None and digest is not None and digest == entry.digest and deps_unchanged:
+            template, deps = entry.template, entry.deps
+        else:
+            self.reads = {}
+            template = compile_template(data.decode(self.encoding), cache=self.cache,
+                                        partials=self if self.inline else None, name=name)
+            deps = tuple(self.reads[dep] for dep, _ in template.depends)
+
+        self.entries[name] = _Entry(path=path, stat=stat, digest=digest, template=template, deps=deps)
+        self.entries.move_to_end(name)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return template
+
+    def get_text(self, name: str) -> t.Optional[str]:
+        """
+        Return the text of template `name`, None if it is not found.
+        """
+        path = self.find(name)
+        if path is None:
+            return None
+        stat = _stat(path)
+        with open(path, "rb") as f:
+            text = f.read().decode(self.encoding)
+        self.reads[name] = (path, stat)
+        return text
+
+    def render(self, name: str, ctx: t.Any = None) -> str:
+        """
+        Render template `name`, with its partials loaded by this loader as well.
+        """
+        template = self.get(name)
+        if template is None:
+            raise TemplateNotFound(f"template '{name}' not found on {self.search_path}")
+        return template.render(ctx, partials=self)
+
+    def clear(self) -> None:
+        self.entries.clear()
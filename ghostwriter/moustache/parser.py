@@ -2,6 +2,8 @@
 """
 import attr
 import typing as t
+from itertools import islice
+from types import MappingProxyType
 from ghostwriter.lang.lexer import Token
 
 PRECEDENCE_LOWEST = 0
@@ -15,7 +17,7 @@ ASTNode = t.Any
 TokenStream = t.Generator[Token, None, None]
 
 PrefixFn = t.Callable[["Parser"], ASTNode]
-InfixFn = t.Callable[["Parser"], ASTNode]
+InfixFn = t.Callable[["Parser", ASTNode], ASTNode]
 
 
 class ParseError(Exception):
@@ -48,21 +50,78 @@ class ExpectedTokenError(ParseError):
         super().__init__(self.message)
 
 
+@attr.s(slots=True, frozen=True)
+class Rule:
+    """
+    How to parse a token type: as a prefix, as an infix (and how tightly it binds).
+    """
+    prefix = attr.ib(type=t.Optional[PrefixFn], default=None)
+    infix = attr.ib(type=t.Optional[InfixFn], default=None)
+    precedence = attr.ib(type=int, default=PRECEDENCE_LOWEST)
+
+
+NO_RULE = Rule()
+
+
+def _frozen(m: t.Optional[t.Mapping[TokenType, t.Any]]) -> t.Mapping[TokenType, t.Any]:
+    return MappingProxyType(dict(m or {}))
+
+
+def _rules(grammar: "Grammar") -> t.Mapping[TokenType, Rule]:
+    types = set(grammar.prefix_parse_fns) | set(grammar.infix_parse_fns) | set(grammar.precedences)
+    return MappingProxyType({
+        typ: Rule(
+            prefix=grammar.prefix_parse_fns.get(typ),
+            infix=grammar.infix_parse_fns.get(typ),
+            precedence=grammar.precedences.get(typ, PRECEDENCE_LOWEST))
+        for typ in types
+    })
+
+
+@attr.s(slots=True, frozen=True)
+class Grammar:
+    """
+    The parse functions and precedences of a language, built once and shared by every Parser.
+
+    A Grammar is immutable, the with_*() methods return extended copies.
+    The functions and precedence of each token type are resolved into a
+    single Rule up front, so the Parser dispatches with one lookup.
+    """
+    prefix_parse_fns = attr.ib(type=t.Mapping[TokenType, PrefixFn], factory=dict, converter=_frozen)
+    infix_parse_fns = attr.ib(type=t.Mapping[TokenType, InfixFn], factory=dict, converter=_frozen)
+    precedences = attr.ib(type=t.Mapping[TokenType, int], factory=dict, converter=_frozen)
+
+    rules = attr.ib(init=False, repr=False, type=t.Mapping[TokenType, Rule],
+                    default=attr.Factory(_rules, takes_self=True))
+
+    def rule(self, typ: TokenType) -> Rule:
+        return self.rules.get(typ, NO_RULE)
+
+    def with_prefix_fns(self, m: t.Mapping[TokenType, PrefixFn]) -> "Grammar":
+        return attr.evolve(self, prefix_parse_fns={**self.prefix_parse_fns, **m})
+
+    def with_infix_fns(self, m: t.Mapping[TokenType, InfixFn]) -> "Grammar":
+        return attr.evolve(self, infix_parse_fns={**self.infix_parse_fns, **m})
+
+    def with_precedences(self, m: t.Mapping[TokenType, int]) -> "Grammar":
+        return attr.evolve(self, precedences={**self.precedences, **m})
+
+
+EMPTY_GRAMMAR = Grammar()
+
+
 # TODO: refactor this out into a base Parser
 @attr.s(slots=True)
 class Parser:
     tokens = attr.ib(type=TokenStream)
-    errors = attr.ib(type=t.List[ParseError], init=False)
+    grammar = attr.ib(type=Grammar, default=EMPTY_GRAMMAR)
+    errors = attr.ib(type=t.List[ParseError], init=False, factory=list)
 
     curr_token = attr.ib(type=Token, init=False)
     peek_token = attr.ib(type=Token, init=False)
 
-    prefix_parse_fns = attr.ib(type=t.Dict[TokenType, PrefixFn], default={})
-    infix_parse_fns = attr.ib(type=t.Dict[TokenType, InfixFn], default={})
-    precedences = attr.ib(type=t.Dict[TokenType, int], default={})
-
     # For the parser to store additional data
-    ctx = attr.ib(type=t.Dict[str, t.Any], default={})
+    ctx = attr.ib(type=t.Dict[str, t.Any], factory=dict)
 
     def __attrs_post_init__(self):
         # Initialization - set {curr,peek}_token up so parser is ready for use
@@ -77,6 +136,18 @@ class Parser:
         except StopIteration:
             self.peek_token = EOF
 
+    @property
+    def prefix_parse_fns(self) -> t.Mapping[TokenType, PrefixFn]:
+        return self.grammar.prefix_parse_fns
+
+    @property
+    def infix_parse_fns(self) -> t.Mapping[TokenType, InfixFn]:
+        return self.grammar.infix_parse_fns
+
+    @property
+    def precedences(self) -> t.Mapping[TokenType, int]:
+        return self.grammar.precedences
+
     def advance(self) -> Token:
         curr = self.curr_token
         try:
@@ -104,44 +175,196 @@ class Parser:
     def prefixfn_missing_error(self, typ: TokenType) -> None:
         self.errors.append(NoPrefixParseFunction(typ))
 
-    def curr_precedence(self, typ: TokenType) -> int:
-        return self.precedences.get(typ, PRECEDENCE_LOWEST)
+    def curr_precedence(self, typ: t.Optional[TokenType] = None) -> int:
+        return self.grammar.rule(self.curr_token.type if typ is None else typ).precedence
 
-    def peek_precedence(self, typ: TokenType) -> int:
-        return self.precedences.get(typ, PRECEDENCE_LOWEST)
+    def peek_precedence(self, typ: t.Optional[TokenType] = None) -> int:
+        return self.grammar.rule(self.peek_token.type if typ is None else typ).precedence
 
     def register_prefix_fns(self, m: t.Dict[TokenType, PrefixFn]) -> None:
-        self.prefix_parse_fns = {**self.prefix_parse_fns, **m}
+        # extends this parser's grammar only, build a Grammar to share instead
+        self.grammar = self.grammar.with_prefix_fns(m)
 
     def register_infix_fns(self, m: t.Dict[TokenType, InfixFn]) -> None:
-        self.infix_parse_fns = {**self.infix_parse_fns, **m}
+        self.grammar = self.grammar.with_infix_fns(m)
+
+    def parse_expression(self, precedence: int = PRECEDENCE_LOWEST) -> ASTNode:
+        """
+        Parse the expression starting at the current token, binding operators tighter than `precedence`.
+
+        Returns None (and records an error) if the current token cannot start an expression.
+        """
+        rules = self.grammar.rules
+        typ = self.curr_token.type
+        prefix = rules.get(typ, NO_RULE).prefix
+        if prefix is None:
+            self.prefixfn_missing_error(typ)
+            return None
+        left = prefix(self)
+        while True:
+            rule = rules.get(self.peek_token.type, NO_RULE)
+            if rule.infix is None or precedence >= rule.precedence:
+                return left
+            self.advance()
+            left = rule.infix(self, left)
 
 
-def parse(moustache_tokens) -> ASTNode:
-    p = Parser(tokens=moustache_tokens)
-    section_stack: t.List[ASTNode] = []
-    section = []
-
-    while True:
-        curr = p.advance()
-        if curr == EOF:
-            if len(section_stack) != 0:
-                raise RuntimeError("unexpected EOF, still haven open sections")
-            break
-        if curr.type not in ("SECTION_OPEN", "SECTION_CLOSE"):
-            section.append(curr)
-        elif curr.type == "SECTION_OPEN":
-            section_stack.append(section)
-            section = [curr]
-        else:  # SECTION_CLOSE
-            if section[0].literal != curr.literal:
-                raise RuntimeError("incorrect section nesting")
+@attr.s(slots=True, cmp=False, repr=False)
+class Section(Token):
+    """
+    A section of the AST, standing in for its SECTION_OPEN token.
+
+    Every node of the AST is a Token (TXT, EXPR, PARTIAL) or a Section, so
+    nodes are told apart by their `type` alone, and a section costs one
+    object and a tuple of its contents.
+    """
+    children = attr.ib(type=t.Tuple[Token, ...], default=())
+
+    def __eq__(self, other):
+        if not isinstance(other, Section):
+            return NotImplemented
+        return self.literal == other.literal and self.children == other.children
 
-            parent_section = section_stack[-1]
-            del section_stack[-1]
-            parent_section.append(section)
-            section = parent_section
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Section(literal={self.literal!r}, startpos={self.startpos!r}, children={self.children!r})"
 
-    return section
 
+Node = t.Union[Token, Section]
 
+
+def _section(open_tag: Token, children: t.List[Token]) -> Section:
+    return Section("SECTION", open_tag.literal, open_tag.startpos, tuple(children))
+
+
+@attr.s(slots=True)
+class _TreeBuilder:
+    """
+    Build the AST from its tokens, added one at a time.
+    """
+    # the open tags of the enclosing sections and their contents so far
+    stack = attr.ib(type=t.List[t.Tuple[Token, t.Optional[t.List[Node]]]], factory=list)
+    contents = attr.ib(type=t.Optional[t.List[Node]], default=None)
+    # number of tokens added since the last top-level node was completed
+    count = attr.ib(type=int, default=0)
+    # makes the Section of an open tag and its contents
+    new_section = attr.ib(type=t.Callable[[Token, t.List[Node]], Section], default=_section)
+
+    def add(self, curr: Token) -> t.Optional[t.Tuple[Node, int]]:
+        """
+        Add the next token, return the top-level node it completes (if any) with the number of tokens it spans.
+        """
+        self.count += 1
+        typ = curr.type
+        if typ == "SECTION_OPEN":
+            self.stack.append((curr, self.contents))
+            self.contents = []
+            return None
+        if typ == "SECTION_CLOSE":
+            if not self.stack:
+                raise RuntimeError("incorrect section nesting")
+            open_tag, parent = self.stack.pop()
+            if open_tag.literal != curr.literal:
+                raise RuntimeError("incorrect section nesting")
+            curr = self.new_section(open_tag, self.contents)
+            self.contents = parent
+        if self.contents is not None:
+            self.contents.append(curr)
+            return None
+        count, self.count = self.count, 0
+        return curr, count
+
+    def finish(self) -> None:
+        if self.stack:
+            raise RuntimeError("unexpected EOF, still haven open sections")
+
+
+def parse_nodes(moustache_tokens, new_section: t.Callable[[Token, t.List[Node]], Section] = _section
+                ) -> t.Iterator[t.Tuple[Node, int]]:
+    """
+    Yield each top-level node of the AST, with the number of tokens it spans.
+
+    `new_section(open_tag, contents)` makes the Section of each section.
+    """
+    builder = _TreeBuilder(new_section=new_section)
+    add = builder.add
+    for curr in moustache_tokens:
+        node = add(curr)
+        if node is not None:
+            yield node
+    builder.finish()
+
+
+def parse_tree(moustache_tokens) -> t.List[Node]:
+    """
+    Parse the tokens into a list of nodes, Tokens and Sections.
+    """
+    return [node for node, _ in parse_nodes(moustache_tokens)]
+
+
+def to_lists(nodes: t.Iterable[Node]) -> ASTNode:
+    """
+    Return the AST in nested list form: each section is a list of its
+    SECTION_OPEN token followed by its contents.
+    """
+    # walked with an explicit stack, so sections may be nested arbitrarily deep
+    result: ASTNode = []
+    stack = [(iter(nodes), result)]
+    while stack:
+        remaining, contents = stack[-1]
+        for node in remaining:
+            if node.type == "SECTION":
+                section = [Token("SECTION_OPEN", node.literal, node.startpos)]
+                contents.append(section)
+                stack.append((iter(node.children), section))
+                break
+            contents.append(node)
+        else:
+            stack.pop()
+    return result
+
+
+def from_lists(nodes: ASTNode) -> t.List[Node]:
+    """
+    The inverse of to_lists().
+    """
+    result: t.List[Node] = []
+    # the nodes left in each enclosing section, its contents so far and its open tag
+    stack = [(iter(nodes), result, None)]
+    while stack:
+        remaining, contents, open_tag = stack[-1]
+        for node in remaining:
+            if isinstance(node, list):
+                stack.append((islice(node, 1, None), [], node[0]))
+                break
+            contents.append(node)
+        else:
+            stack.pop()
+            if open_tag is not None:
+                stack[-1][1].append(_section(open_tag, contents))
+    return result
+
+
+def parse(moustache_tokens) -> ASTNode:
+    """
+    Parse the tokens into the nested list form of the AST, see to_lists().
+    """
+    return to_lists(parse_tree(moustache_tokens))
+
+
+async def parse_async(moustache_tokens: t.AsyncIterator[Token]) -> ASTNode:
+    """
+    parse() the tokens of an async token stream, see lexer.lex_async().
+
+    The tokens are parsed as they arrive rather than collected first, so
+    invalid nesting is raised without waiting for the rest of the stream.
+    """
+    builder = _TreeBuilder()
+    nodes = []
+    async for curr in moustache_tokens:
+        node = builder.add(curr)
+        if node is not None:
+            nodes.append(node[0])
+    builder.finish()
+    return to_lists(nodes)
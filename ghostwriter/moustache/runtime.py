@@ -0,0 +1,180 @@
+"""
+
+Helpers called by compiled templates, see compiler.py.
+"""
+import typing as t
+from collections.abc import Mapping
+
+Scope = t.Any
+Stack = t.List[Scope]
+
+
+def lookup(stack: Stack, name: str) -> t.Any:
+    """
+    Return the value of `name` in the innermost scope defining it, None if none do.
+
+    Scopes are mappings (looked up by key) or any other object (looked up by attribute).
+    """
+    for i in range(len(stack) - 1, -1, -1):
+        scope = stack[i]
+        if type(scope) is dict or isinstance(scope, Mapping):
+            if name in scope:
+                return scope[name]
+        else:
+            try:
+                return getattr(scope, name)
+            except AttributeError:
+                pass
+    return None
+
+
+def get_attr(value: t.Any, name: str) -> t.Any:
+    """
+    Return `value.name` (or `value[name]` for mappings), None if it has none.
+    """
+    if type(value) is dict or isinstance(value, Mapping):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def get_item(value: t.Any, key: t.Any) -> t.Any:
+    """
+    Return `value[key]`, None if it has no such item.
+    """
+    try:
+        return value[key]
+    except (LookupError, TypeError):
+        return None
+
+
+# ordering comparisons in expressions, false if either value is None (e.g. missing)
+def lt(a: t.Any, b: t.Any) -> bool:
+    return a is not None and b is not None and a < b
+
+
+def le(a: t.Any, b: t.Any) -> bool:
+    return a is not None and b is not None and a <= b
+
+
+def gt(a: t.Any, b: t.Any) -> bool:
+    return a is not None and b is not None and a > b
+
+
+def ge(a: t.Any, b: t.Any) -> bool:
+    return a is not None and b is not None and a >= b
+
+
+def to_str(value: t.Any) -> str:
+    if type(value) is str:
+        return value
+    return "" if value is None else str(value)
+
+
+def scopes(value: t.Any) -> t.Iterable[Scope]:
+    """
+    Return the scopes to render a section with `value` in.
+
+    Nothing if `value` is falsy, each element of a (non-string, non-mapping)
+    iterable, or else `value` itself.
+    """
+    if not value:
+        return ()
+    if isinstance(value, (str, bytes, Mapping)) or not hasattr(value, "__iter__"):
+        return (value,)
+    return value
+
+
+# filters by name, applied in expressions as `value | name(args...)`, see expr.py
+FILTERS: t.Dict[str, t.Callable[..., t.Any]] = {}
+
+
+def register_filter(name: str) -> t.Callable[[t.Callable[..., t.Any]], t.Callable[..., t.Any]]:
+    """
+    Register the decorated function as filter `name`.
+
+    Filters are bound when an expression is compiled, so register them before
+    compiling the templates using them.
+    """
+    def register(fn: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
+        FILTERS[name] = fn
+        return fn
+    return register
+
+
+@register_filter("upper")
+def _upper(value: t.Any) -> str:
+    return to_str(value).upper()
+
+
+@register_filter("lower")
+def _lower(value: t.Any) -> str:
+    return to_str(value).lower()
+
+
+@register_filter("title")
+def _title(value: t.Any) -> str:
+    return to_str(value).title()
+
+
+@register_filter("strip")
+def _strip(value: t.Any) -> str:
+    return to_str(value).strip()
+
+
+@register_filter("length")
+def _length(value: t.Any) -> int:
+    return 0 if value is None else len(value)
+
+
+@register_filter("default")
+def _default(value: t.Any, default: t.Any = "") -> t.Any:
+    return default if value is None or value == "" else value
+
+
+@register_filter("join")
+def _join(value: t.Any, sep: str = "") -> str:
+    return "" if value is None else sep.join(to_str(v) for v in value)
+
+
+@register_filter("first")
+def _first(value: t.Any) -> t.Any:
+    return next(iter(value), None) if value is not None else None
+
+
+@register_filter("last")
+def _last(value: t.Any) -> t.Any:
+    return get_item(value, -1) if value else None
+
+
+class Partials(dict):
+    """
+    The partials used in a render, each looked up (and compiled) once.
+
+    `source` maps names to compiled Templates or template strings, e.g. a
+    dict or a Loader. Its get() is called for the first use of a partial.
+    """
+    __slots__ = ("source",)
+
+    def __init__(self, source: t.Optional[t.Any]):
+        super().__init__()
+        self.source = source
+
+    def __missing__(self, name: str) -> t.Optional[t.Any]:
+        template = self.source.get(name) if self.source is not None else None
+        if isinstance(template, str):
+            from .compiler import compile_template  # which imports this module
+            template = compile_template(template)
+        self[name] = template
+        return template
+
+
+def render_partial(partials: t.Optional[Partials], name: str, stack: Stack) -> t.Iterable[str]:
+    """
+    Render partial `name` in the current scope, partials which are not found render as nothing.
+    """
+    if partials is None:
+        return ()
+    template = partials[name]
+    if template is None:
+        return ()
+    return template.render_body(stack, partials)
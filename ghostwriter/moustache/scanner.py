@@ -0,0 +1,89 @@
+"""
+
+A regex-driven engine for lexing moustache templates held in memory.
+
+MoustacheLexer drives the generic Lexer one primitive at a time. For a
+template already in memory, RegexMoustacheLexer instead compiles the
+delimiters in effect into a single regex matching a whole tag, and finds
+the tags with finditer(), in a single pass over the text. The regex is
+cached per delimiter pair, a delimiter change (`{{=<% %>=}}`) switches to
+the regex of the new pair.
+
+Both engines produce the same tokens. Invalid tags are rare, so rather than
+duplicating MoustacheLexer's error reporting, the text from the first tag
+the regex fails to match on is handed over to MoustacheLexer, which raises
+the very same LexerError.
+"""
+import attr
+import re
+import typing as t
+from functools import lru_cache
+from io import StringIO
+from ghostwriter.lang import lexer
+from ghostwriter.lang.token import Token
+from .lexer import MoustacheLexer
+
+TAG_TYPES = {">": "PARTIAL", "#": "SECTION_OPEN", "/": "SECTION_CLOSE"}
+
+
+@lru_cache(maxsize=32)
+def tag_regex(seq_open: str, seq_close: str) -> t.Pattern[str]:
+    """
+    Return the regex matching a tag, or failing that, the bare `seq_open` of an invalid one.
+    """
+    o, c = re.escape(seq_open), re.escape(seq_close)
+    return re.compile(
+        o + r"(?:"
+        r"(?P<tag>[>#/])[ \t]*(?P<ident>[A-Za-z0-9_]*)[ \t]*" + c
+        + r"|!.*?" + c
+        + r"|=(?P<delims>.*?)=" + c
+        + r"|(?![>#/!=])[ \t]*(?P<expr>.*?)[ \t]*" + c
+        + r"|(?P<invalid>))",
+        re.DOTALL)
+
+
+@attr.s(slots=True)
+class RegexMoustacheLexer:
+    text = attr.ib(type=str)
+    seq_open = attr.ib(type=str, default="{{")
+    seq_close = attr.ib(type=str, default="}}")
+
+    def start(self) -> t.Generator[Token, None, None]:
+        text = self.text
+        pos = 0
+        restart = True
+        while restart:
+            restart = False
+            for m in tag_regex(self.seq_open, self.seq_close).finditer(text, pos):
+                start = m.start()
+                if start != pos:
+                    yield Token("TXT", text[pos:start], pos)
+                pos = m.end()
+                # the last group matched tells the alternatives apart, comments match none
+                group = m.lastgroup
+                if group == "expr":
+                    yield Token("EXPR", m.group("expr"), m.start("expr"))
+                elif group == "ident":
+                    yield Token(TAG_TYPES[m.group("tag")], m.group("ident"), m.start("ident"))
+                elif group == "delims":
+                    delims = m.group("delims").split()
+                    if len(delims) != 2:
+                        yield from self._fallback(start)
+                        return
+                    self.seq_open, self.seq_close = delims
+                    restart = True  # with the regex of the new delimiters
+                    break
+                elif group == "invalid":
+                    yield from self._fallback(start)
+                    return
+        if pos < len(text):
+            yield Token("TXT", text[pos:], pos)
+
+    def _fallback(self, pos: int) -> t.Generator[Token, None, None]:
+        """
+        Lex the text from the tag at `pos` on with MoustacheLexer.
+        """
+        lex = lexer.Lexer(StringIO(self.text))
+        lex.next(pos)
+        lex.ignore()
+        yield from MoustacheLexer(lex, seq_open=self.seq_open, seq_close=self.seq_close).start()
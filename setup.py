@@ -4,6 +4,13 @@ from setuptools import find_packages
 import re
 
 req_line_rgx = re.compile(r'^-r\s+(?P<fname>.+)$')
+version_rgx = re.compile(r'^__version__\s*=\s*[\'"](?P<version>[^\'"]+)[\'"]', re.MULTILINE)
+
+
+def version_from(fname):
+    # read rather than imported, the package's dependencies may not be installed yet
+    with open(fname) as f:
+        return version_rgx.search(f.read()).group('version')
 
 
 def requirements_from(fname):
@@ -35,7 +42,7 @@ test_requirements = list(requirements_from('requirements.dev.txt'))
 
 setup(
     name='ghostwriter',
-    version='0.1',
+    version=version_from('ghostwriter/__init__.py'),
     packages=find_packages(),
     license='MIT',
     long_description=open('README.md').read(),
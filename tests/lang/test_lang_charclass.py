@@ -0,0 +1,42 @@
+import pytest
+from io import StringIO
+from ghostwriter.lang import lexer
+from ghostwriter.lang.charclass import CharClass, charclass
+
+DIGITS = CharClass("0123456789")
+
+
+@pytest.mark.parametrize("alphabet, txt, exp_while, exp_until", [
+    ("abc", "abcabcx", "abcabc", ""),
+    ("abc", "xyzabc", "", "xyz"),
+    ("", "hello", "", "hello"),
+    # characters with special meaning inside a regex character class
+    ("]^-\\", "^-]\\x", "^-]\\", ""),
+    ("\n", "\n\nline", "\n\n", ""),
+])
+def test_spans(alphabet, txt, exp_while, exp_until):
+    cc = CharClass(alphabet)
+    assert txt[:cc.span_while(txt).end()] == exp_while
+    assert txt[:cc.span_until(txt).end()] == exp_until
+
+
+def test_charclass_caches_strings():
+    assert charclass("abc") is charclass("abc"), "string alphabets should be compiled once"
+    assert charclass(DIGITS) is DIGITS, "CharClass instances should be passed through"
+
+
+def test_charclass_set_semantics():
+    assert CharClass("cba") == CharClass("abc")
+    assert "5" in DIGITS and "a" not in DIGITS
+    assert (DIGITS | "ab").chars == frozenset("0123456789ab")
+
+
+@pytest.mark.parametrize("method, expected", [
+    ("next_while", "1234"),
+    ("peek_while", "1234"),
+    ("next_until", ""),
+    ("peek_until", ""),
+])
+def test_lexer_accepts_charclass(method, expected):
+    lf = lexer.Lexer(StringIO("1234\n5678"))
+    assert getattr(lf, method)(DIGITS) == expected
@@ -0,0 +1,57 @@
+import marshal
+import os
+from importlib.util import MAGIC_NUMBER
+from ghostwriter.lang.codecache import DiskCodeCache
+
+
+def test_store_load(tmp_path):
+    cache = DiskCodeCache(tmp_path / "cache")
+    key = cache.key("source", "options")
+    assert cache.load(key) is None
+
+    code = compile("x = 1 + 1", "<test>", "exec")
+    assert cache.store(key, ("source", code))
+    source, loaded = DiskCodeCache(tmp_path / "cache").load(key)
+    env = {}
+    exec(loaded, env)
+    assert (source, env["x"]) == ("source", 2)
+    assert [n for n in os.listdir(cache.directory) if not n.endswith(".gwc")] == [], "no temporary files left"
+
+
+def test_key():
+    cache = DiskCodeCache("unused")
+    assert cache.key("a", "b") == cache.key("a", "b")
+    assert cache.key("ab", "c") != cache.key("a", "bc")
+    assert cache.key("a") != cache.key("a", "")
+
+
+def test_unreadable_entries(tmp_path):
+    cache = DiskCodeCache(tmp_path)
+    key = cache.key("x")
+    cache.store(key, 42)
+
+    data = open(cache.path(key), "rb").read()
+    open(cache.path(key), "wb").write(data[:-1])
+    assert cache.load(key) is None, "truncated entries are ignored"
+
+    open(cache.path(key), "wb").write(b"\0\0\0\0" + marshal.dumps(42))
+    assert cache.load(key) is None, "entries from other interpreters are ignored"
+
+    open(cache.path(key), "wb").write(MAGIC_NUMBER + marshal.dumps(42))
+    assert cache.load(key) == 42
+
+
+def test_store_failure(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    cache = DiskCodeCache(blocker / "cache")
+    assert not cache.store(cache.key("x"), 1), "unwritable caches are not an error"
+    assert cache.load(cache.key("x")) is None
+
+
+def test_clear(tmp_path):
+    cache = DiskCodeCache(tmp_path)
+    cache.store(cache.key("x"), 1)
+    (tmp_path / "other").write_text("")
+    cache.clear()
+    assert os.listdir(tmp_path) == ["other"]
@@ -0,0 +1,195 @@
+import sys
+import traceback
+import tracemalloc
+from io import StringIO
+from ghostwriter.lang import codeemitter, sourcemap
+from ghostwriter.lang.codecache import DiskCodeCache
+from ghostwriter.lang.codeemitter import CodeEmitter, clear_code_cache, compile_source
+
+_real_compile = compile
+
+
+def _emitter():
+    e = CodeEmitter()
+    e.add_line("def f():")
+    e.indent()
+    body = e.add_section()
+    e.add_line("return x")
+    e.dedent()
+    body.add_line("x = 1")
+    nested = body.add_section()
+    nested.add_line("x += 1")
+    return e
+
+
+EXPECTED = "def f():\n   x = 1\n   x += 1\n   return x\n"
+
+
+def test_str():
+    assert str(_emitter()) == EXPECTED
+    assert _emitter().evaluate()["f"]() == 2
+
+
+def test_iter_chunks():
+    assert "".join(_emitter().iter_chunks()) == EXPECTED
+    assert list(CodeEmitter().iter_chunks()) == []
+
+
+def test_write_to(monkeypatch):
+    out = StringIO()
+    _emitter().write_to(out)
+    assert out.getvalue() == EXPECTED
+
+    # in several writes
+    monkeypatch.setattr(CodeEmitter, "WRITE_SIZE", 8)
+    writes = []
+    _emitter().write_to(type("W", (), {"write": lambda self, s: writes.append(s)})())
+    assert "".join(writes) == EXPECTED
+    assert len(writes) > 1
+
+
+def test_deeply_nested_sections():
+    e = CodeEmitter()
+    section = e
+    depth = sys.getrecursionlimit() * 2
+    for i in range(depth):
+        section.add_line(f"# {i}")
+        section = section.add_section()
+    text = str(e)
+    assert text.count("\n") == depth
+    assert text.endswith(f"# {depth - 1}\n")
+
+
+def test_rendering_is_cached():
+    e = CodeEmitter()
+    first = e.add_section()
+    second = e.add_section()
+    deeper = second.add_section()
+    first.add_line("a = 1")
+    deeper.add_line("b = 2")
+    assert str(e) == "a = 1\nb = 2\n"
+    assert str(e) is str(e)
+    parts = first._parts
+    assert parts == ["a = 1\n"] and second._parts == [deeper]
+    # only the section rendered keeps its text
+    assert first._text is None and deeper._text is None
+
+    # only the lines of the changed section are rendered again
+    deeper.add_line("c = 3")
+    assert e._text is None and deeper._parts is None
+    assert str(e) == "a = 1\nb = 2\nc = 3\n"
+    assert first._parts is parts and second._parts == [deeper]
+
+    second.indent()
+    second.add_line("d = 4")
+    assert str(e) == "a = 1\nb = 2\nc = 3\n   d = 4\n"
+    assert "".join(e.iter_chunks()) == str(e)
+
+    # a section rendered on its own gives up its text once its parent is rendered
+    text = str(first)
+    first.add_line("e = 5")
+    assert e._text is None and str(first) is not text
+    assert str(e) == "a = 1\ne = 5\nb = 2\nc = 3\n   d = 4\n" and first._text is None
+
+
+def test_rendering_memory_does_not_grow_with_depth():
+    e = CodeEmitter()
+    section = e
+    depth = 200
+    line = "x" * 1000
+    for _ in range(depth):
+        section.add_line(line)
+        section = section.add_section()
+    tracemalloc.start()
+    try:
+        text = str(e)
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert len(text) > depth * len(line)
+    # the text, and each line once; caching the text of every section would take ~depth / 2 times that
+    assert memory < 3 * len(text)
+
+
+def test_compact_lines():
+    e = _emitter()
+    # one entry per line or section, the indentation kept apart
+    assert e.code[0] == "def f():" and list(e.levels) == [0, 3, 3]
+    e.add_line("pass")
+    e.dedent()
+    e.add_line("negative")
+    assert str(e).endswith("return x\npass\nnegative\n")
+    chunks = list(_emitter().iter_chunks())
+    assert chunks[3] is chunks[6], "indentation strings are shared"
+
+
+def test_evaluate_reuses_code(monkeypatch):
+    clear_code_cache()
+    e = _emitter()
+    assert compile_source(str(e)) is compile_source(str(_emitter()))
+
+    compiled = []
+    monkeypatch.setattr("builtins.compile", lambda *args: compiled.append(args) or _real_compile(*args))
+    monkeypatch.setattr(codeemitter, "CODE_CACHE_SIZE", 1)
+    assert e.evaluate()["f"]() == 2
+    assert compiled == []
+    other = CodeEmitter()
+    other.add_line("y = 1")
+    other.evaluate()  # evicts e's code
+    e.evaluate()
+    assert len(compiled) == 2
+
+
+def test_evaluate_env():
+    env = {"x": 1}
+    e = CodeEmitter()
+    e.add_line("y = x + 1")
+    assert e.evaluate(env) is env
+    assert env["y"] == 2
+    env["x"] = 5
+    assert e.evaluate(env)["y"] == 6
+
+
+def test_evaluate_disk_cache(tmp_path, monkeypatch):
+    cache = DiskCodeCache(tmp_path)
+    clear_code_cache()
+    assert _emitter().evaluate(cache=cache)["f"]() == 2
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # another process, its memory cache empty, loads the code from disk
+    clear_code_cache()
+    monkeypatch.setattr("builtins.compile", None)
+    assert _emitter().evaluate(cache=cache)["f"]() == 2
+
+
+def test_source_map():
+    e = CodeEmitter()
+    e.add_line("import sys")
+    e.add_line("def f(x):", origin=("t", 0))
+    e.indent()
+    body = e.add_section()
+    e.add_line("return x", origin=("t", 20))
+    e.dedent()
+    body.add_line('x = """a\nb"""', origin=("t", 10))
+    body.add_section().add_line("pass")
+    assert _emitter().source_map() is None
+    assert e.source_map() == [None, ("t", 0), ("t", 10), ("t", 10), None, ("t", 20)]
+    assert len(e.source_map()) == str(e).count("\n")
+
+
+def test_evaluate_source():
+    e = CodeEmitter()
+    e.add_line("def f():", origin=("tpl", 1))
+    e.indent()
+    e.add_line("return 1 / 0", origin=("tpl", 2))
+    e.dedent()
+    f = e.evaluate()["f"]
+    filename = f.__code__.co_filename
+    assert filename == sourcemap.source_filename(str(e))
+    try:
+        f()
+    except ZeroDivisionError:
+        tb = traceback.format_exc()
+    assert filename in tb and "return 1 / 0" in tb
+    assert sourcemap.origin(filename, 2) == ("tpl", 2)
+    assert sourcemap.origin(filename, 3) is None
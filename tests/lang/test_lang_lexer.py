@@ -1,6 +1,7 @@
+import os
 import pytest
 from ghostwriter.lang import lexer
-from io import StringIO
+from io import BytesIO, StringIO
 
 # TODO: test pos + ignore
 # TODO: test rewind + pos
@@ -215,10 +216,10 @@ def test_ignore_partial():
     print("post-ignore pos:", lf.pos)
     assert lf.current() == "", "ignore should discard all consumed characters"
 
-    assert lf.buf.startswith("k b"), (
+    assert lf.buf[lf.buf_start:].startswith("k b"), (
         "lexer buffer should start with remaining unconsumed characters\n"
         "\tunconsumed: 'k b'\n"
-        "\tactual: {}".format(lf.buf[:+3] + "..."))
+        "\tactual: {}".format(lf.buf[lf.buf_start:lf.buf_start + 3] + "..."))
 
     assert lf.pos == pos_8, "stream position number incorrectly inferred"
 
@@ -239,6 +240,25 @@ def test_emit():
     assert tok == lexer.Token(type="fn", literal="foo", startpos=4)
 
 
+def test_emit_lazy():
+    lf = lexer.Lexer(StringIO(PROG), lazy=True, read_size=4)
+    lf.next(3)
+    kw = lf.emit("KW")
+    lf.next(1)
+    lf.ignore()
+    lf.next_until("(")
+    fn = lf.emit("fn")
+    lf.next_until("")  # forces the buffer to be refilled/compacted a few times
+
+    assert not isinstance(kw._literal, str), "literal should not be built before it is read"
+    assert kw == lexer.Token(type="KW", literal="def", startpos=0)
+    assert kw.literal == "def" and isinstance(kw._literal, str)
+    assert fn.literal == "foo" and fn.startpos == 4
+
+    fn.literal = "bar"
+    assert fn == lexer.Token(type="fn", literal="bar")
+
+
 ALPHABET_EN = "AaBbCcDdEeFfGgHhIiJjKkLlMmNnOoPpQqRrSsTtUuVvWwXxYyZz"
 
 
@@ -579,4 +599,281 @@ def test_next_until_seq(seq, expected):
     assert res == expected, "did not get expected string back"
 
 
-# TODO: next_until_seq EOF test
+@pytest.mark.parametrize("read_size", [1, 2, 3, 5, 32768])
+@pytest.mark.parametrize("seq, expected", [
+    ("{{", "hello { world }\n"),
+    ("{{#", "hello { world }\n{{}}"),
+    ("{", "hello "),
+    ("}}}", "hello { world }\n{{}}{{#names"),
+])
+def test_next_until_seq_straddles_refills(read_size, seq, expected):
+    lf = lexer.Lexer(StringIO("hello { world }\n{{}}{{#names}}}"), read_size=read_size)
+    assert lf.next_until_seq(seq) == expected
+    assert lf.current() == expected
+    assert lf.peek(len(seq)) == seq, "cursor should be left at the start of the sequence"
+    assert not lf.eof
+
+
+@pytest.mark.parametrize("txt", ["", "no tags here", "almost {", "almost {{"])
+def test_next_until_seq_eof(txt):
+    lf = lexer.Lexer(StringIO(txt), read_size=2)
+    assert lf.next_until_seq("{{{") == txt, "should consume everything when seq is not found"
+    assert lf.eof
+    assert lf.pos == len(txt)
+
+
+def test_skip_until_seq():
+    lf = lexer.Lexer(StringIO("hello {{world}}"))
+    assert lf.skip_until_seq("{{") == 6
+    assert lf.current() == "hello "
+    assert lf.pos == 6
+
+
+###############################################################################
+# memory-mapped input
+###############################################################################
+@pytest.fixture
+def mapped_prog(tmp_path):
+    fname = tmp_path / "prog.py"
+    fname.write_bytes(PROG.encode("utf-8"))
+    lf = lexer.lex_file(str(fname), mapped=True)
+    yield lf
+    lf.close()
+
+
+def test_mapped_scan(mapped_prog):
+    lf = mapped_prog
+    assert lf.binary, "mapped lexer should scan the mapped bytes directly"
+    assert lf.next_while(ALPHABET_EN) == "def"
+    tok = lf.emit("KW")
+    assert tok == lexer.Token(type="KW", literal="def", startpos=0)
+    assert tok.startpos == 0
+
+    lf.next_while(" ")
+    lf.ignore()
+    assert lf.peek_until("(") == "foo"
+    assert lf.next_until_seq(":") == "foo(a, b)"
+    tok = lf.emit("SIG")
+    assert tok.literal == "foo(a, b)" and tok.startpos == 4
+
+    assert lf.next_until("") == PROG[13:], "should read to the end of the mapping"
+    assert lf.eof
+    assert lf.next(1) == ""
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_mapped_decodes_literals(tmp_path, lazy):
+    fname = tmp_path / "utf8.txt"
+    fname.write_bytes("ære være {{x}}".encode("utf-8"))
+    lf = lexer.lex_file(str(fname), mapped=True, lazy=lazy)
+    lf.next_until("{")
+    tok = lf.emit("TXT")
+    assert tok.literal == "ære være "
+    assert lf.pos == len("ære være ".encode("utf-8")), "positions are byte offsets in mapped mode"
+    lf.close()
+
+
+def test_mapped_lazy_tokens_after_close(tmp_path):
+    fname = tmp_path / "utf8.txt"
+    fname.write_bytes("ære være {{x}}".encode("utf-8"))
+    lf = lexer.lex_file(str(fname), mapped=True, lazy=True)
+    lf.next_until("{")
+    tok = lf.emit("TXT")
+    lf.close()
+    assert tok.literal == "ære være ", "the mapping is kept for the tokens sliced from it"
+
+    lf = lexer.lex_file(str(fname), mapped=True, lazy=True)
+    lf.close()
+    assert lf.stream.closed, "closed right away without lazy tokens"
+
+
+def test_mapped_empty_file(tmp_path):
+    fname = tmp_path / "empty.txt"
+    fname.write_bytes(b"")
+    lf = lexer.lex_file(str(fname), mapped=True)
+    assert lf.next(1) == ""
+    assert lf.eof
+
+
+###############################################################################
+# buffer refills
+###############################################################################
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7])
+def test_small_reads(read_size):
+    """
+    Force tiny refills so tokens and scans straddle many chunk boundaries.
+    """
+    lf = lexer.Lexer(StringIO(PROG), read_size=read_size)
+    assert lf.next_while(ALPHABET_EN) == "def"
+    assert lf.emit("KW") == lexer.Token(type="KW", literal="def")
+    lf.next(1)
+    lf.ignore()
+    assert lf.peek_until("(") == "foo"
+    assert lf.next_until(":") == "foo(a, b)"
+    tok = lf.emit("SIG")
+    assert tok.literal == "foo(a, b)" and tok.startpos == 4
+    assert lf.next_while(":\n ") == ":\n    "
+    assert lf.current() == ":\n    "
+    assert lf.next_until("") == "return 30\n"
+    assert lf.eof
+
+
+###############################################################################
+# binary input
+###############################################################################
+@pytest.mark.parametrize("source", [
+    lambda b: BytesIO(b),
+    lambda b: bytes(b),
+    lambda b: bytearray(b),
+    lambda b: memoryview(b),
+], ids=["BytesIO", "bytes", "bytearray", "memoryview"])
+@pytest.mark.parametrize("read_size", [1, 3, 32768])
+def test_binary_source(source, read_size):
+    lf = lexer.Lexer(source("æble {{kage}}\nslut".encode("utf-8")), read_size=read_size)
+    assert lf.binary
+    assert lf.next_until_seq("{{") == "æble "
+    tok = lf.emit("TXT")
+    assert tok.literal == "æble " and tok.startpos == 0
+    assert lf.pos == 6, "positions should be byte offsets"
+
+    lf.next(2)
+    lf.ignore()
+    assert lf.skip_while(ALPHABET_EN) == 4
+    assert lf.emit("EXPR") == lexer.Token(type="EXPR", literal="kage", startpos=8)
+    assert lf.peek_until("\n") == "}}"
+    assert lf.next_until_seq("}}}") == "}}\nslut"
+    assert lf.eof
+
+
+@pytest.mark.parametrize("read_size", [1, 32768])
+def test_binary_split_characters(read_size):
+    lf = lexer.Lexer(BytesIO("æ€x".encode("utf-8")), read_size=read_size)
+    # next()/peek() count bytes, a character they split is returned whole
+    assert lf.peek(1) == "æ"
+    assert lf.next(1) == "æ" and lf.pos == 1
+    assert lf.peek(1) == "\ufffd", "the rest of a character cannot be decoded on its own"
+    assert lf.next(2) == "\ufffd€" and lf.pos == 3
+    assert lf.next(2) == "\ufffd\ufffd"
+    assert lf.next(1) == "x" and lf.pos == 6
+    assert lf.emit("TXT").literal == "æ€x", "literals are decoded as a whole"
+
+
+def test_binary_encoding():
+    lf = lexer.Lexer(BytesIO("æble {{x}}".encode("latin-1")), encoding="latin-1")
+    lf.skip_until_seq("{{")
+    assert lf.emit("TXT").literal == "æble "
+
+
+def test_binary_rejects_non_ascii_alphabet():
+    lf = lexer.Lexer(BytesIO(b"abc"))
+    with pytest.raises(ValueError):
+        lf.next_while("æøå")
+
+
+###############################################################################
+# line/column lookup
+###############################################################################
+@pytest.mark.parametrize("source", [
+    lambda: StringIO(PROG),
+    lambda: BytesIO(PROG.encode("utf-8")),
+    lambda: PROG.encode("utf-8"),
+], ids=["text", "binary", "buffer"])
+def test_line_col(source):
+    lf = lexer.Lexer(source(), read_size=4)
+    assert lf.line_col() == (1, 1)
+    lf.next_until_seq("return")
+    assert lf.line_col() == (2, 5)
+    tok = lf.emit("TXT")
+    assert lf.line_col(tok.startpos) == (1, 1)
+    lf.next_until("")
+    assert lf.line_col() == (3, 1)
+    assert lf.line_col(4) == (1, 5)
+
+
+def test_error_line_col():
+    lf = lexer.Lexer(StringIO(PROG))
+    lf.next_until_seq("30")
+    with pytest.raises(lexer.LexerExpectError) as exc_info:
+        lf.expect_next("31")
+    err = exc_info.value
+    assert (err.line, err.col) == (2, 14)
+    assert "line=2" in str(err)
+
+
+###############################################################################
+# non-seekable streams
+###############################################################################
+class ForwardOnly:
+    """
+    A stream which can only be read forwards, counting the characters handed out.
+    """
+    def __init__(self, txt, max_read=None):
+        self.stream = StringIO(txt)
+        self.max_read = max_read
+        self.handed_out = 0
+
+    def read(self, n=-1):
+        if self.max_read is not None:
+            n = min(n, self.max_read)
+        chunk = self.stream.read(n)
+        self.handed_out += len(chunk)
+        return chunk
+
+    def seekable(self):
+        return False
+
+
+@pytest.mark.parametrize("max_read", [None, 1, 5])
+def test_forward_only_stream(max_read):
+    line = "{{x}} text {\n"
+    src = ForwardOnly(line * 1000, max_read)
+    lf = lexer.Lexer(src, read_size=64, track_lines=False)
+    for _ in range(1000):
+        lf.next_until_seq("}}")
+        lf.next(2)
+        lf.ignore()
+        lf.next_until_seq("{{")
+        assert lf.emit("TXT").literal == " text {\n"
+        assert lf.buf_len <= 3 * 64, "should retain little more than the unemitted input"
+    assert lf.next(1) == "" and lf.eof
+    assert src.handed_out == len(line) * 1000
+    with pytest.raises(RuntimeError):
+        lf.line_col()
+
+
+def test_pipe():
+    """
+    Tokens from a pipe are lexed while the producer is still writing.
+    """
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, "rb") as reader, os.fdopen(write_fd, "wb", buffering=0) as writer:
+        lf = lexer.Lexer(reader)
+        writer.write(b"hello {{")
+        assert lf.next_until_seq("{{") == "hello ", "should not wait for the pipe to be closed"
+        writer.write(b"world}}")
+        writer.close()
+        lf.next(2)
+        assert lf.next_until_seq("}}") == "world"
+        assert lf.next_until_seq("{{") == "}}"
+        assert lf.eof
+
+
+@pytest.mark.parametrize("read_size", [1, 3, 32768])
+def test_save_restore(read_size):
+    lf = lexer.Lexer(StringIO("hello {{world}} bye"), read_size=read_size)
+    lf.next_until_seq("{{")
+    lf.emit("TXT")
+    state = lf.save()
+    lf.next(2)
+    lf.ignore()
+    assert lf.next_until_seq("}}") == "world"
+    lf.emit("EXPR")
+    lf.next_until_seq("{{")  # reads to EOF, refilling the buffer
+    assert lf.eof
+    lf.restore(state)
+    assert not lf.eof
+    assert lf.pos == 6
+    assert lf.next_until_seq("}}") == "{{world"
+    lf.release()
+    with pytest.raises(RuntimeError):
+        lf.restore(state)
@@ -0,0 +1,30 @@
+import pytest
+from ghostwriter.lang.lineindex import LineIndex
+
+TXT = "one\ntwo\n\nfour"
+
+
+@pytest.mark.parametrize("pos, expected", [
+    (0, (1, 1)),
+    (2, (1, 3)),
+    (3, (1, 4)),  # the newline itself belongs to the line it ends
+    (4, (2, 1)),
+    (8, (3, 1)),
+    (9, (4, 1)),
+    (12, (4, 4)),
+])
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_line_col(pos, expected, chunk_size):
+    index = LineIndex()
+    for n in range(0, len(TXT), chunk_size):
+        index.feed(TXT[n:n + chunk_size])
+    assert index.line_col(pos) == expected
+
+
+def test_feed_bytes_range():
+    index = LineIndex()
+    buf = memoryview(TXT.encode("utf-8"))
+    index.feed(buf, 0, 5)
+    index.feed(buf, 5)
+    assert list(index.starts) == [0, 4, 8, 9]
+    assert index.indexed == len(TXT)
@@ -0,0 +1,112 @@
+import cProfile
+import gc
+import linecache
+import pstats
+import sys
+import time
+from ghostwriter.lang import sourcemap
+from ghostwriter.lang.codeemitter import CodeEmitter, clear_code_cache
+
+
+def _generate():
+    e = CodeEmitter()
+    e.add_line("def slow(n):", origin=("page.moustache", 10))
+    e.indent()
+    e.add_line("return sum(i * i for i in range(n))", origin=("page.moustache", 12))
+    e.dedent()
+    e.add_line("def fast():", origin=("page.moustache", 40))
+    e.indent()
+    e.add_line("return 1")
+    e.dedent()
+    return e.evaluate()
+
+
+def test_fold_stats():
+    env = _generate()
+    profile = cProfile.Profile()
+    profile.enable()
+    for _ in range(3):
+        env["slow"](10000)
+        env["fast"]()
+    profile.disable()
+
+    folded = sourcemap.fold_stats(profile)
+    assert folded == sourcemap.fold_stats(pstats.Stats(profile))
+    # the generator expression is defined on the line generated from offset 12
+    assert set(folded) == {("page.moustache", 10), ("page.moustache", 12), ("page.moustache", 40)}
+    assert folded[("page.moustache", 10)].calls == 3
+    assert folded[("page.moustache", 40)].calls == 3
+    assert folded[("page.moustache", 10)].cumtime >= folded[("page.moustache", 12)].tottime
+
+
+def test_line_profiler():
+    e = CodeEmitter()
+    e.add_line("def run(wait):", origin=("t", 0))
+    e.indent()
+    e.add_line("wait(0.01)", origin=("t", 1))
+    e.add_line("for i in range(3):", origin=("t", 2))
+    e.indent()
+    e.add_line("nested(wait)", origin=("t", 3))
+    e.dedent()
+    e.dedent()
+    e.add_line("def nested(wait):", origin=("t", 4))
+    e.indent()
+    e.add_line("wait(0.005)", origin=("t", 5))
+    e.dedent()
+    run = e.evaluate()["run"]
+
+    previous = sys.gettrace()
+    with sourcemap.LineProfiler() as profiler:
+        run(time.sleep)
+    assert sys.gettrace() is previous
+    stats = profiler.stats
+    assert stats[("t", 1)].calls == 1 and stats[("t", 3)].calls == 3 and stats[("t", 5)].calls == 3
+    # time in the functions called is attributed to the line calling them, unless generated
+    assert stats[("t", 1)].tottime >= 0.01
+    assert stats[("t", 5)].tottime >= 0.015
+    assert stats[("t", 3)].cumtime >= 0.015 > stats[("t", 3)].tottime
+
+
+def test_caller_origin():
+    def helper():
+        return sourcemap.caller_origin()
+
+    filename, lineno = helper()
+    assert filename == __file__
+    assert lineno == test_caller_origin.__code__.co_firstlineno + 4
+
+
+def test_origin_unknown():
+    assert sourcemap.origin("<nowhere>", 1) is None
+
+
+def test_registered_while_code_is_alive():
+    clear_code_cache()
+    functions = []
+    for i in range(300):
+        e = CodeEmitter()
+        e.add_line("def f():")
+        e.indent()
+        e.add_line(f"return {i}", origin=("t", i))
+        e.dedent()
+        functions.append(e.evaluate()["f"])
+    # only the functions' code is alive, not that of the modules defining them
+    clear_code_cache()
+    gc.collect()
+    filenames = [f.__code__.co_filename for f in functions]
+    assert [sourcemap.origin(filename, 2) for filename in filenames] == [("t", i) for i in range(300)]
+    assert all(filename in linecache.cache for filename in filenames)
+
+    del functions[:]
+    gc.collect()
+    assert not any(sourcemap.origin(filename, 2) or filename in linecache.cache for filename in filenames)
+
+
+def test_unregister():
+    e = CodeEmitter()
+    e.add_line("x = 1", origin=("t", 1))
+    e.evaluate()
+    filename = sourcemap.source_filename(str(e))
+    assert sourcemap.origin(filename, 1) == ("t", 1)
+    sourcemap.unregister(filename)
+    assert sourcemap.origin(filename, 1) is None and filename not in linecache.cache
@@ -0,0 +1,233 @@
+import cProfile
+import itertools
+import pytest
+import sys
+import time
+import traceback
+from io import StringIO
+from ghostwriter.lang import sourcemap
+from ghostwriter.lang.lexer import Lexer
+from ghostwriter.moustache.compiler import FILENAME, compile_ast, compile_template, generate
+from ghostwriter.moustache.lexer import MoustacheLexer
+from ghostwriter.moustache.parser import parse
+
+
+class User:
+    def __init__(self, name, age):
+        self.name = name
+        self.age = age
+
+
+@pytest.mark.parametrize("template, ctx, expected", [
+    ("", {}, ""),
+    ("hello", {}, "hello"),
+    ("hello {{name}}!", {"name": "world"}, "hello world!"),
+    ("hello {{ name }}!", {"name": 42}, "hello 42!"),
+    ("hello {{name}}!", {}, "hello !"),
+    ("hello {{name}}!", {"name": None}, "hello !"),
+    ("hello {{! not shown }}world", {}, "hello world"),
+    ("{{=<? ?>=}}hello <?name?>", {"name": "world"}, "hello world"),
+    # sections over lists, mappings, objects, truthy and falsy values
+    ("{{#items}}- {{name}}\n{{/items}}", {"items": [{"name": "a"}, {"name": "b"}]}, "- a\n- b\n"),
+    ("{{#items}}x{{/items}}", {"items": []}, ""),
+    ("{{#user}}{{name}} is {{age}}{{/user}}", {"user": User("bob", 7)}, "bob is 7"),
+    ("{{#user}}{{name}} is {{age}}{{/user}}", {"user": {"name": "bob", "age": 7}}, "bob is 7"),
+    ("{{#show}}shown{{/show}}", {"show": True}, "shown"),
+    ("{{#show}}shown{{/show}}", {"show": False}, ""),
+    ("{{#show}}shown{{/show}}", {}, ""),
+    ("{{#show}}{{/show}}", {"show": True}, ""),
+    # outer scopes are visible in sections
+    ("{{#items}}{{name}}{{sep}}{{/items}}", {"sep": ",", "items": [{"name": "a"}, {"name": "b"}]}, "a,b,"),
+    ("{{#a}}{{#b}}{{x}}{{y}}{{/b}}{{/a}}", {"a": {"x": 1, "b": [{"y": 2}, {"y": 3}]}}, "1213"),
+    # sections consume iterables lazily
+    ("{{#items}}{{n}}{{/items}}", {"items": ({"n": i} for i in range(3))}, "012"),
+])
+def test_render(template, ctx, expected):
+    assert compile_template(template).render(ctx) == expected
+
+
+def test_render_object_context():
+    assert compile_template("{{name}} is {{age}}").render(User("bob", 7)) == "bob is 7"
+
+
+def test_render_partials():
+    template = compile_template("{{#items}}{{> item}}{{/items}}{{> missing}}")
+    item = compile_template("<{{name}}>")
+    ctx = {"items": [{"name": "a"}, {"name": "b"}]}
+    assert template.render(ctx, partials={"item": item}) == "<a><b>"
+    assert template.render(ctx, partials={"item": "[{{name}}]"}) == "[a][b]"
+    assert template.render(ctx) == ""
+
+
+def test_literal_text_is_merged():
+    m = MoustacheLexer(Lexer(StringIO("hello{{! comment }} world")))
+    source = generate(parse(m.start()))
+    assert "yield 'hello world'" in source
+
+
+def test_compile_ast_reuses_render_function():
+    m = MoustacheLexer(Lexer(StringIO("hello {{name}}")))
+    template = compile_ast(parse(m.start()))
+    assert [template.render({"name": n}) for n in "ab"] == ["hello a", "hello b"]
+
+
+def test_compile_template_is_cached():
+    assert compile_template("hello {{name}}") is compile_template("hello {{name}}")
+    assert compile_template("hello <?name?>", "<?", "?>") is not compile_template("hello <?name?>")
+
+
+def test_compile_template_disk_cache(tmp_path, monkeypatch):
+    from ghostwriter.lang.codecache import DiskCodeCache
+    from ghostwriter.moustache import compiler
+
+    cache = DiskCodeCache(tmp_path)
+    template = "{{#items}}<{{name}}>{{/items}}"
+    ctx = {"items": [{"name": "a"}, {"name": "b"}]}
+    compiled = compiler.compile_template(template, cache=cache)
+    assert compiled.render(ctx) == "<a><b>"
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # a fresh process: nothing in memory, the template is not parsed again
+    compiler.clear_caches()
+    monkeypatch.setattr(compiler, "parse_tree", None)
+    loaded = compiler.compile_template(template, cache=cache)
+    assert loaded is not compiled
+    assert loaded.render(ctx) == "<a><b>"
+    assert loaded.source == compiled.source
+
+    # other delimiters are compiled (and cached) separately
+    monkeypatch.undo()
+    compiler.compile_template(template, "<?", "?>", cache=cache)
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # entries of other versions of the code generator are not loaded
+    compiler.clear_caches()
+    monkeypatch.setattr(compiler, "CODEGEN_VERSION", compiler.CODEGEN_VERSION + ".next")
+    compiler.compile_template(template, cache=cache)
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+@pytest.mark.parametrize("depth", [25, 40])
+def test_deeply_nested_sections(depth):
+    template = "".join(f"{{{{#s{i}}}}}{i}," for i in range(depth)) + "{{x}}"
+    template += "".join(f"{{{{/s{i}}}}}" for i in reversed(range(depth)))
+    ctx = {f"s{i}": True for i in range(depth)}
+    ctx["x"] = "end"
+    compiled = compile_template(template)
+    assert compiled.render(ctx) == "".join(f"{i}," for i in range(depth)) + "end"
+    assert compiled.render({}) == ""
+    assert "yield from section17(stack, partials)" in compiled.source
+
+
+def test_compile_deeply_nested_ast():
+    depth = sys.getrecursionlimit() + 500
+    template = "{{#a}}x" * depth + "{{/a}}" * depth
+    ast = parse(MoustacheLexer(Lexer(StringIO(template))).start())
+    # each scope has the next one, rather than looking it up through all of them
+    ctx = True
+    for _ in range(depth):
+        ctx = {"a": ctx}
+    assert compile_ast(ast).render(ctx) == "x" * depth
+
+
+def test_stream_is_lazy():
+    def items():
+        n = 0
+        while True:  # never ends, must not be turned into a list
+            yield {"n": n}
+            n += 1
+
+    chunks = compile_template("{{#items}}<{{n}}>{{/items}}").stream({"items": items()})
+    assert list(itertools.islice(chunks, 6)) == ["<", "0", ">", "<", "1", ">"]
+
+
+def test_render_to():
+    template = compile_template("{{#items}}{{> item}}\n{{/items}}")
+    ctx = {"items": [{"name": n} for n in "abc"]}
+    out = StringIO()
+    template.render_to(out, ctx, partials={"item": "- {{name}}"})
+    assert out.getvalue() == template.render(ctx, partials={"item": "- {{name}}"}) == "- a\n- b\n- c\n"
+
+
+def test_inline_partials():
+    partials = {"item": "<{{name}}>", "sep": ", "}
+    template = compile_template("{{#items}}{{> item}}{{> sep}}{{/items}}{{> later}}", partials=partials)
+    assert "render_partial(partials, 'item'" not in template.source
+    assert "yield '>, '" in template.source, "inlined text is merged"
+    assert [name for name, _ in template.depends] == ["item", "sep"]
+    ctx = {"items": [{"name": "a"}, {"name": "b"}]}
+    assert template.render(ctx, partials={"later": "."}) == "<a>, <b>, ."
+
+
+def test_inline_recursive_partials():
+    partials = {
+        "even": "e{{#next}}{{> odd}}{{/next}}",
+        "odd": "o{{#next}}{{> even}}{{/next}}",
+    }
+    template = compile_template("{{> even}}", partials=partials)
+    assert "render_partial(partials, 'even'" in template.source, "recursion is left as a call"
+    assert template.render({"next": {"next": {"next": {}}}}, partials=partials) == "eoe"
+    own = compile_template("[{{#next}}{{> self}}{{/next}}]", partials={"self": "x"}, name="self")
+    assert own.depends == ()
+
+
+def test_inline_partials_disk_cache(tmp_path):
+    from ghostwriter.lang.codecache import DiskCodeCache
+
+    cache = DiskCodeCache(tmp_path)
+    partials = {"item": "<{{name}}>"}
+    template = "{{#items}}{{> item}}{{/items}}"
+    ctx = {"items": [{"name": "a"}]}
+    assert compile_template(template, cache=cache, partials=partials).render(ctx) == "<a>"
+    partials["item"] = "[{{name}}]"
+    assert compile_template(template, cache=cache, partials=partials).render(ctx) == "[a]", \
+        "cached code is not used once a partial inlined into it changed"
+
+
+def test_source_map():
+    template = compile_template("a{{#items}}<{{> item}}>{{/items}}", partials={"item": "{{name}}"}, name="page")
+    filename = template.render_body.__code__.co_filename
+    origins = {line.strip(): sourcemap.origin(filename, lineno)
+               for lineno, line in enumerate(template.source.splitlines(), 1)}
+    assert origins["yield 'a'"] == ("page", 0)
+    assert origins["for scope1 in scopes(lookup(stack, 'items')):"] == ("page", 4)
+    assert origins["yield '<'"] == ("page", 11)
+    assert origins["yield to_str(lookup(stack, 'name'))"] == ("item", 2)
+    assert sourcemap.origin(compile_template("{{x}}").render_body.__code__.co_filename, 4) == (FILENAME, 2)
+
+
+def test_traceback_shows_generated_line():
+    class Broken:
+        @property
+        def name(self):
+            raise ValueError("broken")
+
+    template = compile_template("hello {{ user.name }}")
+    with pytest.raises(ValueError) as excinfo:
+        template.render({"user": Broken()})
+    lines = [frame.line for frame in traceback.extract_tb(excinfo.value.__traceback__)]
+    assert "yield to_str(get_attr(lookup(stack, 'user'), 'name'))" in lines
+
+
+def test_fold_stats():
+    template = compile_template("{{#items}}{{n}}{{/items}}", name="numbers")
+    profile = cProfile.Profile()
+    profile.runcall(template.render, {"items": [{"n": n} for n in range(3)]})
+    stats = sourcemap.fold_stats(profile)
+    assert stats[("numbers", 0)].calls > 0
+
+
+def test_line_profiler():
+    class Slow:
+        @property
+        def x(self):
+            time.sleep(0.002)
+            return 1
+
+    template = compile_template("<{{#slow}}{{x}}{{/slow}}{{#fast}}{{y}}{{/fast}}>", name="page")
+    with sourcemap.LineProfiler() as profiler:
+        assert template.render({"slow": [Slow()] * 5, "fast": [{"y": 2}] * 5}) == "<1111122222>"
+    stats = profiler.stats
+    # the time is attributed to the tags of each section rather than to the render function
+    assert stats[("page", 12)].calls == 5 and stats[("page", 12)].tottime >= 0.01
+    assert stats[("page", 35)].calls == 5 and stats[("page", 35)].tottime < stats[("page", 12)].tottime
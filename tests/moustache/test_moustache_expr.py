@@ -0,0 +1,109 @@
+import pytest
+from ghostwriter.moustache import runtime
+from ghostwriter.moustache.compiler import compile_template
+from ghostwriter.moustache.expr import ExpressionError, compile_expression, expression_code
+
+
+class User:
+    def __init__(self, name, tags=()):
+        self.name = name
+        self.tags = list(tags)
+
+
+CTX = {
+    "user": User("bob", ["a", "b"]),
+    "users": [{"name": "x"}, {"name": "y"}],
+    "n": 3,
+    "key": "name",
+    "empty": "",
+}
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("n", 3),
+    ("missing", None),
+    ("user.name", "bob"),
+    ("user.missing.deeper", None),
+    ("users.1.name", "y"),
+    ("users[0]", {"name": "x"}),
+    ("users[0][key]", "x"),
+    ("users[5].name", None),
+    ("user.tags[0]", "a"),
+    ("'lit'", "lit"),
+    ("1.5", 1.5),
+    ("user.name | upper", "BOB"),
+    ("user.tags | join(\", \")", "a, b"),
+    ("missing | default(\"none\")", "none"),
+    ("empty | default(n)", 3),
+    ("users | length", 2),
+    ("users | first | length", 1),
+    ("n == 3", True),
+    ("n != 3", False),
+    ("n < 2.5", False),
+    ("users | length >= 2", True),
+    ("user.name | upper == 'BOB'", True),
+    ("(n > 1) == (n > 2)", True),
+    # ordering comparisons with missing values are false
+    ("missing < 1", False),
+    ("1 <= missing", False),
+    ("user.missing > 'a'", False),
+    ("missing >= missing", False),
+    ("missing == missing", True),
+])
+def test_evaluate(source, expected):
+    assert compile_expression(source)([CTX]) == expected
+
+
+def test_expression_code():
+    assert expression_code("a.b[0]") == ("get_item(get_attr(lookup(stack, 'a'), 'b'), 0)", frozenset())
+    code, filters = expression_code("a | lower | default('x')")
+    assert code == "f_default(f_lower(lookup(stack, 'a')), 'x')"
+    assert filters == {"lower", "default"}
+    assert compile_expression("a.b") is compile_expression("a.b")
+
+
+@pytest.mark.parametrize("source", [
+    "a.", "a |", "a | nosuchfilter", "a[0", "(a", "a b", "a == ", "'unterminated", "a $ b", "a.'b'",
+    "1.2.3", "1.", "a[1.2.3]", "a == 2.5.name",
+    "a | default(|)", "a | join(,)", "a | default(1, |)", "a | default(b | nosuchfilter)",
+])
+def test_invalid(source):
+    with pytest.raises(ExpressionError) as e:
+        expression_code(source)
+    assert e.value.expression == source
+
+
+@pytest.mark.parametrize("template, expected", [
+    ("{{ user.name | title }} has {{ user.tags | length }} tags", "Bob has 2 tags"),
+    ("{{#users}}{{ name | upper }}{{ n > 2 }},{{/users}}", "XTrue,YTrue,"),
+    ("[{{}}]", "[]"),
+    ("{{ missing < 1 }}|{{ n < 4 }}", "False|True"),
+    ("{{ users.1.0 }}", ""),
+])
+def test_render(template, expected):
+    assert compile_template(template).render(CTX) == expected
+
+
+def test_compiled_inline():
+    # the expression is part of the render function, the filter bound once as a default
+    template = compile_template("{{#items}}{{ v.x | upper }}{{/items}}")
+    assert "yield to_str(f_upper(get_attr(lookup(stack, 'v'), 'x')))" in template.source
+    assert "f_upper=FILTERS['upper']" in template.source
+    items = [{"v": {"x": "a"}}] * 1000
+    assert template.render({"items": items}) == "A" * 1000
+
+
+def test_register_filter():
+    @runtime.register_filter("reverse")
+    def reverse(value):
+        return value[::-1]
+
+    try:
+        assert compile_template("{{ s | reverse }}").render({"s": "abc"}) == "cba"
+    finally:
+        del runtime.FILTERS["reverse"]
+
+
+def test_invalid_template():
+    with pytest.raises(ExpressionError):
+        compile_template("hello {{ a | }}")
@@ -0,0 +1,98 @@
+import pytest
+import random
+from ghostwriter.lang import lexer
+from ghostwriter.moustache import incremental
+from ghostwriter.moustache.incremental import Document
+
+PIECES = [
+    "hello ", "world\n", "{{name}}", "{{ name }}", "{{> item}}", "{{! note }}", "{{#items}}", "{{/items}}",
+    "{{#a}}", "{{/a}}", "{{=<? ?>=}}", "<?x?>", "<?={{ }}=?>", "{", "}", "<?", "?>",
+]
+
+
+def snapshot(doc):
+    return (
+        [(tok.type, tok.literal, tok.startpos) for tok in doc.tokens],
+        doc.ast, [(tok.startpos, n, o, c) for tok, n, o, c in doc.checkpoints])
+
+
+def assert_same_as_fresh(doc):
+    fresh = Document(doc.text, doc.seq_open, doc.seq_close)
+    assert snapshot(doc) == snapshot(fresh)
+
+
+def test_edit_reuses_tokens_and_nodes():
+    text = "".join(f"{{{{#s{i}}}}}<{{{{v{i}}}}}>{{{{/s{i}}}}}\n" for i in range(100))
+    doc = Document(text)
+    tokens, ast = list(doc.tokens), list(doc.ast)
+
+    offset = text.index("v50")
+    doc.edit(offset, 3, "renamed")
+    assert_same_as_fresh(doc)
+    reused = sum(a is b for a, b in zip(tokens, doc.tokens)) + sum(a is b for a, b in zip(tokens[::-1], doc.tokens[::-1]))
+    assert reused >= len(tokens) - 6, "only the tokens around the edit are lexed again"
+    assert sum(a is b for a, b in zip(ast, doc.ast)) + sum(a is b for a, b in zip(ast[::-1], doc.ast[::-1])) \
+        >= len(ast) - 2, "only the nodes around the edit are parsed again"
+
+
+def test_edit_delimiters():
+    doc = Document("a{{x}}b{{=<? ?>=}}c<?y?>d<?z?>e")
+    doc.edit(doc.text.index("<? ?>"), 5, "[ ]")
+    assert doc.text == "a{{x}}b{{=[ ]=}}c<?y?>d<?z?>e"
+    assert_same_as_fresh(doc)
+    doc.edit(doc.text.index("<?y"), 0, "[w]")
+    assert_same_as_fresh(doc)
+
+
+def test_edit_error_leaves_document_unchanged():
+    doc = Document("a{{x}}b{{#s}}c{{/s}}")
+    before = snapshot(doc)
+    with pytest.raises(lexer.LexerError) as e:
+        doc.edit(11, 0, "-")  # '{{#s-}}' is not a valid tag
+    assert e.value.pos >= 11, "error positions refer to the whole text"
+    with pytest.raises(RuntimeError):
+        doc.edit(len(doc.text), 0, "{{/s}}")
+    assert snapshot(doc) == before
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_random_edits(seed):
+    rnd = random.Random(seed)
+    doc = Document("".join(rnd.choice(PIECES[:6]) + rnd.choice(["", "{{#items}}{{x}}{{/items}}"]) for _ in range(30)))
+    for _ in range(30):
+        offset = rnd.randint(0, len(doc.text))
+        removed = rnd.randint(0, min(12, len(doc.text) - offset))
+        inserted = "".join(rnd.choice(PIECES) for _ in range(rnd.randint(0, 2)))
+        before = snapshot(doc)
+        try:
+            expected = Document(doc.text[:offset] + inserted + doc.text[offset + removed:])
+        except (lexer.LexerError, RuntimeError):
+            with pytest.raises((lexer.LexerError, RuntimeError)):
+                doc.edit(offset, removed, inserted)
+            assert snapshot(doc) == before
+            continue
+        doc.edit(offset, removed, inserted)
+        assert snapshot(doc) == snapshot(expected)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_edits_small_blocks(seed, monkeypatch):
+    monkeypatch.setattr(incremental, "BLOCK_SIZE", 4)
+    rnd = random.Random(seed)
+    doc = Document("".join(rnd.choice(PIECES[:6]) + rnd.choice(["", "{{#items}}{{x}}{{/items}}"]) for _ in range(30)))
+    for _ in range(30):
+        offset = rnd.randint(0, len(doc.text))
+        removed = rnd.randint(0, min(12, len(doc.text) - offset))
+        inserted = "".join(rnd.choice(PIECES) for _ in range(rnd.randint(0, 2)))
+        try:
+            doc.edit(offset, removed, inserted)
+        except (lexer.LexerError, RuntimeError):
+            pass
+        assert_same_as_fresh(doc)
+
+        # the tokens are in runs sharing a shift, in the order of the shifts, and
+        # neighbouring runs would not fit in a block together
+        runs = [tok.shift for i, tok in enumerate(doc.tokens) if not i or tok.shift is not doc.tokens[i - 1].shift]
+        assert runs == doc._shifts
+        assert [shift.size for shift in runs] == [sum(tok.shift is shift for tok in doc.tokens) for shift in runs]
+        assert all(a.size + b.size > incremental.BLOCK_SIZE for a, b in zip(runs, runs[1:]))
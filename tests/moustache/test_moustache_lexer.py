@@ -1,7 +1,9 @@
+import asyncio
 import pytest
-from io import StringIO
+from io import BytesIO, StringIO
+from ghostwriter.lang import lexer
 from ghostwriter.lang.lexer import Lexer, Token
-from ghostwriter.moustache.lexer import MoustacheLexer
+from ghostwriter.moustache.lexer import MoustacheLexer, lex_async
 
 
 @pytest.mark.parametrize("inp, expected", [
@@ -16,6 +18,8 @@ from ghostwriter.moustache.lexer import MoustacheLexer
     ("{{ name}}", [Token(type='EXPR', literal='name')]),
     ("{{name }}", [Token(type='EXPR', literal='name')]),
     ("{{  name   }}", [Token(type='EXPR', literal='name')]),
+    ("{{ user.name | default(\"}\") }}", [Token(type='EXPR', literal='user.name | default("}")')]),
+    ("{{a >= 1}}", [Token(type='EXPR', literal='a >= 1')]),
 
     # Partial
     ("{{>user}}", [Token(type='PARTIAL', literal='user')]),
@@ -52,9 +56,128 @@ from ghostwriter.moustache.lexer import MoustacheLexer
         Token(type="TXT", literal="hello "),
         Token(type="TXT", literal=" world.")]),
 ])
-def test_moustache(inp, expected):
-    lf = Lexer(StringIO(inp))
+@pytest.mark.parametrize("lazy", [False, True])
+def test_moustache(inp, expected, lazy):
+    lf = Lexer(StringIO(inp), lazy=lazy)
     m = MoustacheLexer(lf)
     toks = list(m.start())
     print(toks)
     assert expected == toks, "did not get expected token sequence"
+
+
+def test_moustache_lazy_text_is_not_decoded(monkeypatch):
+    decoded = []
+    text = Lexer._text
+    monkeypatch.setattr(Lexer, "_text", lambda self, start, end: decoded.append((start, end)) or text(self, start, end))
+    toks = list(MoustacheLexer(Lexer("ære være {{! no }}!".encode("utf-8"), lazy=True)).start())
+    assert decoded == [], "text is only sliced and decoded once the literal is read"
+    assert [tok.literal for tok in toks] == ["ære være ", "!"]
+
+
+def test_moustache_mapped(tmp_path):
+    template = "hello {{name}},\n{{#items}}- {{> item}}\n{{/items}}{{! done }}{{=<? ?>=}}<? bye ?>."
+    fname = tmp_path / "template.txt"
+    fname.write_text(template)
+
+    expected = list(MoustacheLexer(Lexer(StringIO(template))).start())
+    lf = lexer.lex_file(str(fname), mapped=True)
+    actual = list(MoustacheLexer(lf).start())
+    lf.close()
+    assert actual == expected, "mapped input should produce the same tokens"
+    assert [t.startpos for t in actual] == [t.startpos for t in expected]
+
+
+def test_moustache_mapped_non_ascii(tmp_path):
+    template = "hej {{ø}}, {{ navn | upper }}\n{{#ting}}- {{€}}{{/ting}} {{é"
+    fname = tmp_path / "template.txt"
+    fname.write_text(template, encoding="utf-8")
+
+    with pytest.raises(lexer.LexerError) as expected_error:
+        list(MoustacheLexer(Lexer(StringIO(template))).start())
+    lf = lexer.lex_file(str(fname), mapped=True)
+    actual = []
+    with pytest.raises(lexer.LexerError) as error:
+        actual.extend(MoustacheLexer(lf).start())
+    lf.close()
+    expected = list(MoustacheLexer(Lexer(StringIO(template[:-len("{{é")]))).start())
+    assert actual == expected
+    assert error.value.message == expected_error.value.message
+
+
+@pytest.mark.parametrize("source", [BytesIO, memoryview], ids=["BytesIO", "memoryview"])
+@pytest.mark.parametrize("read_size", [1, 32768])
+def test_moustache_binary(source, read_size):
+    template = "hej {{navn}},\n{{#ting}}- {{> ting}}\n{{/ting}}{{! færdig }}{{=<? ?>=}}<? farvel ?>ø."
+    expected = list(MoustacheLexer(Lexer(StringIO(template))).start())
+    lf = Lexer(source(template.encode("utf-8")), read_size=read_size)
+    actual = list(MoustacheLexer(lf).start())
+    assert actual == expected, "binary input should produce the same tokens"
+
+
+@pytest.mark.parametrize("template", ["{{ø}}", "a {{é}} b", "{{ æøå | upper }}", "{{€}}{{#s}}{{𝄞}}{{/s}}", "a {{é"])
+@pytest.mark.parametrize("read_size", [1, 2, 32768])
+def test_moustache_binary_non_ascii_tag(template, read_size):
+    # the character after the open seq is read byte-wise in binary mode
+    def lex(source):
+        try:
+            return [(t.type, t.literal) for t in MoustacheLexer(source).start()], None
+        except lexer.LexerError as e:
+            return None, e.message
+
+    expected = lex(Lexer(StringIO(template)))
+    assert lex(Lexer(BytesIO(template.encode("utf-8")), read_size=read_size)) == expected
+    assert lex(Lexer(template.encode("utf-8"))) == expected
+
+
+async def _lex_pieces(data: bytes, piece: int, **kwargs):
+    reader = asyncio.StreamReader()
+
+    async def upload():
+        for i in range(0, len(data), piece):
+            reader.feed_data(data[i:i + piece])
+            await asyncio.sleep(0)
+        reader.feed_eof()
+
+    uploading = asyncio.ensure_future(upload())
+    toks = [tok async for tok in lex_async(reader, **kwargs)]
+    await uploading
+    return toks
+
+
+@pytest.mark.parametrize("piece", [1, 3, 7, 1000])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_moustache_async(piece, lazy):
+    template = "hej {{navn}},\n{{#ting}}- {{> ting}}\n{{/ting}}{{! færdig }}{{=<? ?>=}}<? farvel ?>ø.<?ø?>"
+    expected = list(MoustacheLexer(Lexer(BytesIO(template.encode("utf-8")))).start())
+    actual = asyncio.run(_lex_pieces(template.encode("utf-8"), piece, read_size=4, lazy=lazy))
+    assert actual == expected, "async input should produce the same tokens"
+    assert [t.startpos for t in actual] == [t.startpos for t in expected]
+
+
+@pytest.mark.parametrize("template, piece, read_size", [
+    # a character split across the pieces uploaded
+    ("a" * 32767 + "é {{ name }}", 32768, lexer.READ_SIZE),
+    *((f"æ{{{{ø}}}}å {{{{#x}}}}é{{{{/x}}}}ü", piece, read_size)
+      for piece in range(1, 6) for read_size in range(1, 5)),
+])
+def test_moustache_async_split_character(template, piece, read_size):
+    expected = list(MoustacheLexer(Lexer(BytesIO(template.encode("utf-8")))).start())
+    actual = asyncio.run(_lex_pieces(template.encode("utf-8"), piece, read_size=read_size))
+    assert actual == expected
+
+
+def test_moustache_async_iterable():
+    async def chunks():
+        for chunk in (b"hello {", b"{na", b"me}} and {{", b"! no }}bye"):
+            yield chunk
+
+    async def lex():
+        return [tok async for tok in lex_async(chunks())]
+
+    assert asyncio.run(lex()) == [
+        Token("TXT", "hello "), Token("EXPR", "name"), Token("TXT", " and "), Token("TXT", "bye")]
+
+
+def test_moustache_async_error():
+    with pytest.raises(lexer.LexerError):
+        asyncio.run(_lex_pieces(b"hello {{name", 2))
@@ -0,0 +1,118 @@
+import os
+import pytest
+from ghostwriter.moustache import compiler
+from ghostwriter.moustache.loader import Loader, TemplateNotFound
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """
+    Count the templates parsed (rather than served from a cache).
+    """
+    count = []
+    parse_tree = compiler.parse_tree
+
+    def counting_parse(tokens):
+        count.append(1)
+        return parse_tree(tokens)
+
+    compiler.clear_caches()
+    monkeypatch.setattr(compiler, "parse_tree", counting_parse)
+    return count
+
+
+def touch(path, text, mtime_ns):
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_search_path(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    (first / "page.moustache").write_text("{{#items}}{{> item}}{{/items}}")
+    (second / "item").write_text("<{{name}}>")
+    (second / "page").write_text("shadowed")
+
+    loader = Loader([first, second])
+    assert loader.find("page") == str(first / "page.moustache")
+    assert loader.find("missing") is None
+    assert loader.find("../first/page") is None
+    assert loader.render("page", {"items": [{"name": "a"}, {"name": "b"}]}) == "<a><b>"
+    with pytest.raises(TemplateNotFound):
+        loader.render("missing")
+
+
+def test_partial_in_loop_is_loaded_once(tmp_path, parses, monkeypatch):
+    (tmp_path / "page").write_text("{{#items}}{{> item}}{{/items}}")
+    (tmp_path / "item").write_text("{{n}},")
+    loader = Loader([tmp_path], inline=False)
+
+    gets = []
+    get = Loader.get
+    monkeypatch.setattr(Loader, "get", lambda self, name: gets.append(name) or get(self, name))
+    out = loader.render("page", {"items": [{"n": i} for i in range(10000)]})
+    assert out == "".join(f"{i}," for i in range(10000))
+    assert gets == ["page", "item"], "each partial is looked up once per render"
+    assert len(parses) == 2
+
+    loader.render("page", {"items": [{"n": 1}]})
+    assert len(parses) == 2, "compiled templates are cached between renders"
+
+
+def test_mtime_invalidation(tmp_path, parses):
+    path = tmp_path / "page"
+    touch(path, "one", 10 ** 18)
+    loader = Loader([tmp_path])
+    assert loader.render("page") == "one"
+    touch(path, "two", 10 ** 18 + 10 ** 9)
+    assert loader.render("page") == "two"
+    assert len(parses) == 2
+
+    path.unlink()
+    assert loader.get("page") is None
+
+
+@pytest.mark.parametrize("check_hash", [False, True])
+def test_hash_check(tmp_path, parses, check_hash):
+    path = tmp_path / "page"
+    touch(path, "same", 10 ** 18)
+    loader = Loader([tmp_path], check_hash=check_hash)
+    template = loader.get("page")
+    compiler.clear_caches()
+    touch(path, "same", 10 ** 18 + 10 ** 9)
+    assert (loader.get("page") is template) == check_hash
+    assert len(parses) == (1 if check_hash else 2)
+
+
+def test_lru(tmp_path):
+    for name in "abc":
+        (tmp_path / name).write_text(name)
+    loader = Loader([tmp_path], maxsize=2)
+    for name in "abac":
+        loader.get(name)
+    assert list(loader.entries) == ["a", "c"]
+
+
+def test_inlined_partials(tmp_path, parses):
+    (tmp_path / "page").write_text("{{#items}}{{> item}}{{/items}}")
+    (tmp_path / "item").write_text("{{n}},")
+    loader = Loader([tmp_path])
+    template = loader.get("page")
+    assert "render_partial(" not in template.source
+    assert [name for name, _ in template.depends] == ["item"]
+    assert loader.render("page", {"items": [{"n": 1}, {"n": 2}]}) == "1,2,"
+
+    # changing an inlined partial recompiles the templates including it
+    touch(tmp_path / "item", "<{{n}}>", 10 ** 18)
+    assert loader.get("page") is not template
+    assert loader.render("page", {"items": [{"n": 1}, {"n": 2}]}) == "<1><2>"
+
+
+def test_recursive_partial(tmp_path):
+    (tmp_path / "tree").write_text("{{name}}{{#children}}({{> tree}}){{/children}}")
+    loader = Loader([tmp_path])
+    tree = {"name": "a", "children": [
+        {"name": "b", "children": [{"name": "c", "children": []}]},
+        {"name": "d", "children": []}]}
+    assert loader.render("tree", tree) == "a(b(c))(d)"
@@ -1,8 +1,11 @@
+import asyncio
+import attr
 import pytest
+import sys
 from io import StringIO
 from ghostwriter.lang.lexer import Lexer, Token
-from ghostwriter.moustache.lexer import MoustacheLexer
-from ghostwriter.moustache.parser import parse
+from ghostwriter.moustache.lexer import MoustacheLexer, lex_async
+from ghostwriter.moustache.parser import Grammar, Parser, Rule, Section, from_lists, parse, parse_async, parse_tree, to_lists
 
 
 @pytest.mark.parametrize("template, ast", [
@@ -27,3 +30,117 @@ def test_moustache(template, ast):
 
     print(ast)
     assert actual_ast == ast
+
+
+def test_moustache_async():
+    template = b"details: {{#user}}name: {{name}}\nage: {{age}}{{/user}}"
+
+    async def chunks():
+        for i in range(0, len(template), 5):
+            yield template[i:i + 5]
+
+    expected = parse(MoustacheLexer(Lexer(StringIO(template.decode()))).start())
+    assert asyncio.run(parse_async(lex_async(chunks()))) == expected
+
+
+def test_moustache_async_is_incremental():
+    async def tokens():
+        yield Token("TXT", "a")
+        yield Token("SECTION_CLOSE", "user")
+        raise AssertionError("read past the invalid section")
+
+    with pytest.raises(RuntimeError, match="incorrect section nesting"):
+        asyncio.run(parse_async(tokens()))
+
+
+def test_parse_tree():
+    template = "a{{#outer}}b{{#inner}}{{x}}{{/inner}}{{> p}}{{/outer}}c"
+    tree = parse_tree(MoustacheLexer(Lexer(StringIO(template))).start())
+    assert [node.type for node in tree] == ["TXT", "SECTION", "TXT"]
+    outer = tree[1]
+    assert (outer.literal, outer.startpos) == ("outer", 4)
+    assert [node.type for node in outer.children] == ["TXT", "SECTION", "PARTIAL"]
+    assert outer.children[1] == Section("SECTION", "inner", children=(Token("EXPR", "x"),))
+    assert outer.children[1] != Section("SECTION", "inner")
+
+    lists = parse(MoustacheLexer(Lexer(StringIO(template))).start())
+    assert to_lists(tree) == lists
+    assert from_lists(lists) == tree
+
+
+def test_deeply_nested_sections():
+    depth = sys.getrecursionlimit() + 500
+    template = "{{#a}}x" * depth + "{{/a}}" * depth
+    lists = parse(MoustacheLexer(Lexer(StringIO(template))).start())
+    tree = from_lists(lists)
+    for _ in range(depth):
+        [section] = lists
+        assert section[0].type == "SECTION_OPEN" and section[1] == Token("TXT", "x")
+        lists = section[2:]
+        [section] = tree
+        assert section.type == "SECTION" and section.children[0] == Token("TXT", "x")
+        tree = section.children[1:]
+    assert lists == [] and tree == ()
+
+
+@pytest.mark.parametrize("template", ["{{/a}}", "{{#a}}{{/b}}", "{{#a}}{{#b}}{{/a}}{{/b}}", "{{#a}}"])
+def test_parse_tree_nesting_errors(template):
+    with pytest.raises(RuntimeError):
+        parse_tree(MoustacheLexer(Lexer(StringIO(template))).start())
+
+
+def _number(p):
+    return int(p.curr_token.literal)
+
+
+def _binary(p, left):
+    op = p.curr_token
+    precedence = p.curr_precedence()
+    p.advance()
+    return [op.literal, left, p.parse_expression(precedence)]
+
+
+ARITHMETIC = Grammar(
+    prefix_parse_fns={"NUM": _number},
+    infix_parse_fns={"ADD": _binary, "MUL": _binary},
+    precedences={"ADD": 1, "MUL": 2})
+
+
+def _tokens(expr):
+    types = {"+": "ADD", "*": "MUL"}
+    return iter([Token(types.get(c, "NUM"), c) for c in expr.split()])
+
+
+@pytest.mark.parametrize("expr, ast", [
+    ("1", 1),
+    ("1 + 2", ["+", 1, 2]),
+    ("1 + 2 * 3", ["+", 1, ["*", 2, 3]]),
+    ("1 * 2 + 3", ["+", ["*", 1, 2], 3]),
+    ("1 + 2 + 3", ["+", ["+", 1, 2], 3]),
+])
+def test_grammar_parse_expression(expr, ast):
+    p = Parser(_tokens(expr), ARITHMETIC)
+    assert p.parse_expression() == ast
+    assert p.errors == []
+
+
+def test_grammar_shared_and_immutable():
+    p1, p2 = Parser(_tokens("1"), ARITHMETIC), Parser(_tokens("2"), ARITHMETIC)
+    assert p1.grammar is p2.grammar
+    with pytest.raises(TypeError):
+        ARITHMETIC.precedences["ADD"] = 3
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        ARITHMETIC.precedences = {}
+
+    # extending a parser's grammar leaves the shared one alone
+    p1.register_prefix_fns({"ADD": _number})
+    assert "ADD" in p1.prefix_parse_fns and "ADD" not in ARITHMETIC.prefix_parse_fns
+    assert ARITHMETIC.with_precedences({"ADD": 3}).rule("ADD").precedence == 3
+    assert ARITHMETIC.rule("ADD") == Rule(infix=_binary, precedence=1)
+    assert ARITHMETIC.rule("UNKNOWN") == Rule()
+
+
+def test_grammar_missing_prefix():
+    p = Parser(_tokens("+ 1"), ARITHMETIC)
+    assert p.parse_expression() is None
+    assert [e.token_type for e in p.errors] == ["ADD"]
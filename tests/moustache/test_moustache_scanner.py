@@ -0,0 +1,78 @@
+import random
+import pytest
+from io import StringIO
+from ghostwriter.lang import lexer
+from ghostwriter.lang.lexer import Lexer
+from ghostwriter.moustache.lexer import MoustacheLexer
+from ghostwriter.moustache.scanner import RegexMoustacheLexer, tag_regex
+
+
+def _lex(tokens):
+    """
+    The tokens (type, literal, startpos) produced, and the error raised if any.
+    """
+    out = []
+    try:
+        for tok in tokens:
+            out.append((tok.type, tok.literal, tok.startpos))
+    except lexer.LexerError as e:
+        return out, (type(e), e.pos, e.line, e.col, e.message)
+    return out, None
+
+
+def assert_same(template, **kwargs):
+    expected = _lex(MoustacheLexer(Lexer(StringIO(template)), **kwargs).start())
+    assert _lex(RegexMoustacheLexer(template, **kwargs).start()) == expected
+    return expected
+
+
+@pytest.mark.parametrize("template", [
+    "",
+    "hello",
+    "hello {{name}}!",
+    "{{ name }}{{  name\t}}{{}}{{ }}",
+    "{{ user.name | default(\"x\") }}",
+    "{{>user}}{{> user }}{{#item}}{{# item }}{{/item}}{{/ item }}",
+    "{{#}}{{/ }}{{>1a_b}}",
+    "a {{! hello, this won't be shown}} b {{!}}",
+    "{{=<? ?>=}}hello <? name ?>.{{name}}<?={{ }}=?>{{x}}",
+    "{{=<% %>=}}<%#a%><%/a%>",
+    "{{{a}}}",
+    "{{ #a}}",
+    "multi\nline {{\nname\n}}\n{{#s}}\n{{/s}}",
+    "{ { } }} {",
+    # invalid tags
+    "{{",
+    "text {{",
+    "{{#a b}}",
+    "{{>a-b}}",
+    "{{/a",
+    "{{name",
+    "{{! comment",
+    "{{=<% %>",
+    "{{=<%=}}",
+    "{{=a b c=}}",
+    "line\n{{=<% %>=}}\n<%#a b%>",
+])
+def test_same_as_moustache_lexer(template):
+    assert_same(template)
+
+
+def test_errors():
+    tokens, error = assert_same("line\nline {{#a b}}")
+    assert tokens == [("TXT", "line\nline ", 0)]
+    assert error[1:4] == (15, 2, 11)
+
+
+def test_delimiters():
+    assert_same("<%name%>{{name}}", seq_open="<%", seq_close="%>")
+    assert tag_regex("{{", "}}") is tag_regex("{{", "}}")
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random(seed):
+    rng = random.Random(seed)
+    pieces = ["a", " ", "\n", "\t", "{", "}", "{{", "}}", "#", "/", ">", "!", "=", "x_1", "-", ".",
+              "{{=<% %>=}}", "<%", "%>", "<%={{ }}=%>"]
+    for _ in range(20):
+        assert_same("".join(rng.choice(pieces) for _ in range(rng.randint(0, 30))))